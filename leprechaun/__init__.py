@@ -8,3 +8,5 @@ sdata_dir = dir / "data"  # Static data dir
 data_dir = Path(user_data_dir("leprechaun", appauthor=False, roaming=False))
 miners_dir = data_dir / "miners"
 miner_crashes_dir = data_dir / "miner-crashes"
+miner_logs_dir = data_dir / "miner-logs"
+stats_dir = data_dir / "stats"
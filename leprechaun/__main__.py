@@ -1,14 +1,14 @@
 import sys
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
 from pathlib import Path
 
 from PySide6.QtCore import QCoreApplication
 from PySide6.QtWidgets import QApplication
 
 import leprechaun as le
-from leprechaun import config
+from leprechaun import benchmark, config
 from leprechaun.application import Application, CliApplication
-from leprechaun.util import isroot
+from leprechaun.util import InvalidConfigError, isroot, parse_duration
 
 
 # Parser ===============================================================================================================
@@ -21,6 +21,12 @@ def config_file(arg):
     else:
         return path
 
+def duration(arg):
+    try:
+        return parse_duration({"duration": arg}, "duration")
+    except (InvalidConfigError, ValueError):
+        raise ArgumentTypeError(f"invalid duration '{arg}' (use ms, s, m, h, d suffixes to designate time)") from None
+
 parser.set_defaults(subcommand=None)
 subparsers = parser.add_subparsers(title="subcommands")
 
@@ -33,6 +39,7 @@ parser.add_argument("file",
 )
 parser.add_argument("-g", "--gui", action="store_true", help="launch with graphical interface")
 parser.add_argument("-p", "--pipe-log", action="store_true", help="write log to file instead of stdout")
+parser.add_argument("-e", "--event-log", action="store_true", help="write structured events to events.jsonl")
 
 # config ---------------------------------------------------------------------------------------------------------------
 parser_config = subparsers.add_parser("config", description="Configure leprechaun.")
@@ -58,6 +65,30 @@ parser_config.add_argument("--add-security-exception",
     help="add windows security exception for the leprechaun folder"
 )
 
+# benchmark ------------------------------------------------------------------------------------------------------------
+parser_benchmark = subparsers.add_parser("benchmark",
+    description="Measure hashrate, CPU time and memory of configured miners, one at a time, and save the results for "
+    "estimates. Do not run while Leprechaun is mining."
+)
+parser_benchmark.set_defaults(subcommand="benchmark")
+
+parser_benchmark.add_argument("miners",
+    nargs="*",
+    help="names of miners to benchmark (default: all miners in the config file)"
+)
+
+parser_benchmark.add_argument("-w", "--warmup",
+    type=duration,
+    default="1m",
+    help="time to let each miner reach full speed before measuring (default: 1m)"
+)
+
+parser_benchmark.add_argument("-d", "--duration",
+    type=duration,
+    default="2m",
+    help="time to measure each miner for (default: 2m)"
+)
+
 
 # ======================================================================================================================
 def main():
@@ -68,10 +99,10 @@ def main():
         # Run Leprechaun -----------------------------------------------------------------------------------------------
         if args.gui:
             qapp = QApplication([])
-            app = Application(args.file, args.pipe_log)
+            app = Application(args.file, args.pipe_log, args.event_log)
         else:
             qapp = QCoreApplication([])
-            app = CliApplication(args.file, args.pipe_log)
+            app = CliApplication(args.file, args.pipe_log, args.event_log)
 
         app.start()
         return qapp.exec()
@@ -92,6 +123,14 @@ def main():
 
         if args.add_desktop_shortcut:
             config.add_shortcut(Path("~/Desktop").expanduser())
+    elif args.subcommand == "benchmark":
+        # Benchmark ----------------------------------------------------------------------------------------------------
+        le.data_dir.mkdir(parents=True, exist_ok=True)
+
+        try:
+            benchmark.run(args.file, args.miners, args.warmup, args.duration)
+        except (FileNotFoundError, InvalidConfigError) as e:
+            parser.error(str(e))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,134 @@
+from collections import OrderedDict, namedtuple
+from functools import wraps
+from threading import Event, Lock
+from time import monotonic
+
+from cachetools.keys import hashkey
+
+_Entry = namedtuple("_Entry", ["expires", "value", "error"])
+
+
+class _Call:
+    """An upstream call in progress, which other callers with the same key wait for."""
+
+    def __init__(self):
+        self.done = Event()
+        self.value = None
+        self.error = None
+
+
+class Uncached:
+    """Return value of a function decorated with `TTLCache`, which is passed to callers but not cached."""
+
+    def __init__(self, value):
+        self.value = value
+
+
+class TTLCache:
+    """Thread-safe memoizing cache with expiring entries, for functions that query remote APIs.
+
+    - Concurrent misses for the same arguments are coalesced into a single call of the function;
+    - Exceptions are cached for `error_ttl` seconds, so that a failing server is not queried by every caller;
+    - When there are more than `maxsize` entries, least recently used ones are evicted.
+
+    Use as a decorator: `@TTLCache(ttl=60)`. The decorated function gets `stats()` and `clear()` attributes. It may
+    return `Uncached(value)` for values that should not be kept, like stale ones that are being revalidated.
+    """
+
+    def __init__(self, ttl, *, error_ttl=10, maxsize=64):
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.maxsize = maxsize
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+
+        self._entries = OrderedDict()
+        self._calls = {}
+        self._lock = Lock()
+
+    def __call__(self, fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            return self._get(fn, args, kwargs)
+
+        wrapper.stats = self.stats
+        wrapper.clear = self.clear
+        return wrapper
+
+    def stats(self) -> dict[str, int]:
+        """Return counters of cache hits, misses, coalesced misses and cached errors."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced, "errors": self.errors}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _get(self, fn, args, kwargs):
+        key = hashkey(*args, **kwargs)
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and entry.expires > monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._result(entry.value, entry.error)
+
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                owner = False
+            else:
+                self.misses += 1
+                call = self._calls[key] = _Call()
+                owner = True
+
+        if not owner:
+            call.done.wait()
+            return self._result(call.value, call.error)
+
+        completed = False
+        try:
+            try:
+                call.value = fn(*args, **kwargs)
+            except Exception as e:
+                call.error = e
+            completed = True
+
+            uncached = isinstance(call.value, Uncached)
+            if uncached:
+                call.value = call.value.value
+        finally:
+            # Waiters must be released even if the call was interrupted, for example by KeyboardInterrupt
+            with self._lock:
+                if not completed:
+                    # Not cached, so that the next call tries again
+                    call.error = RuntimeError(f"call of '{fn.__name__}' was interrupted")
+                elif call.error is not None:
+                    self._entries[key] = _Entry(monotonic() + self.error_ttl, None, call.error)
+                    self.errors += 1
+                elif uncached:
+                    self._entries.pop(key, None)  # An expired entry would only take up space
+                else:
+                    self._entries[key] = _Entry(monotonic() + self.ttl, call.value, None)
+
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+
+                del self._calls[key]
+
+            call.done.set()
+
+        return self._result(call.value, call.error)
+
+    @staticmethod
+    def _result(value, error):
+        if error is not None:
+            raise error
+        return value
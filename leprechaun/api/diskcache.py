@@ -0,0 +1,106 @@
+import json
+import sqlite3
+from collections import namedtuple
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Callable, Optional
+
+Entry = namedtuple("Entry", ["data", "etag", "last_modified", "fetched"])
+"""A cached response: parsed JSON data, validators for conditional requests, and the time it was last confirmed."""
+
+
+class DiskCache:
+    """Persistent cache of API responses with least-recently-used eviction, stored in an SQLite database.
+
+    The cache is an optimization: if the database is locked or damaged, entries read as missing and writes are dropped,
+    so that callers fall back to the network. The first error of a streak is passed to `onerror`.
+    """
+
+    def __init__(self, path, maxsize=256):
+        self.path = Path(path)
+        self.maxsize = maxsize
+        self.onerror: Optional[Callable[[Exception], None]] = None
+        self._db = None
+        self._failing = False
+        self._lock = Lock()
+
+    def get(self, key) -> Optional[Entry]:
+        with self._lock:
+            try:
+                db = self._connect()
+                row = db.execute(
+                    "SELECT data, etag, last_modified, fetched FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+
+                if row is not None:
+                    db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (time(), key))
+                    db.commit()
+            except sqlite3.Error as e:
+                self._failed(e)
+                return None
+            self._failing = False
+
+        if row is None:
+            return None
+
+        data, etag, last_modified, fetched = row
+        try:
+            return Entry(json.loads(data), etag, last_modified, fetched)
+        except (TypeError, ValueError):
+            return None  # Damaged entry, replaced on the next fetch
+
+    def put(self, key, entry: Entry):
+        with self._lock:
+            try:
+                db = self._connect()
+                db.execute(
+                    "INSERT OR REPLACE INTO entries (key, data, etag, last_modified, fetched, accessed) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, json.dumps(entry.data), entry.etag, entry.last_modified, entry.fetched, time())
+                )
+                db.execute(
+                    "DELETE FROM entries WHERE key NOT IN (SELECT key FROM entries ORDER BY accessed DESC LIMIT ?)",
+                    (self.maxsize,)
+                )
+                db.commit()
+            except sqlite3.Error as e:
+                self._failed(e)
+            else:
+                self._failing = False
+
+    def touch(self, key):
+        """Mark an entry as confirmed by the server just now, without changing its data."""
+        with self._lock:
+            try:
+                db = self._connect()
+                db.execute("UPDATE entries SET fetched = ? WHERE key = ?", (time(), key))
+                db.commit()
+            except sqlite3.Error as e:
+                self._failed(e)
+            else:
+                self._failing = False
+
+    def _failed(self, error: sqlite3.Error):
+        """Drop the connection, so that the next call opens the database again. Must be called with the lock held."""
+        if self._db is not None:
+            try:
+                self._db.close()
+            except sqlite3.Error:
+                pass
+            self._db = None
+
+        if not self._failing and self.onerror is not None:
+            self.onerror(error)
+        self._failing = True
+
+    def _connect(self):
+        if self._db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, data TEXT, etag TEXT, last_modified TEXT, fetched REAL, accessed REAL)"
+            )
+
+        return self._db
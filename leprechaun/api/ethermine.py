@@ -1,20 +1,19 @@
-import sys
-import requests as rq
-from cachetools import cached, TTLCache
+from . import http
+from .cache import TTLCache, Uncached
 
 currency_precision = 18
 
-@cached(TTLCache(maxsize=sys.maxsize, ttl=120))
-def request(page, addr):
-    url = f"https://api.ethermine.org/miner/{addr[2:]}/{page}"
-    page = rq.get(url)
-    page.raise_for_status()
-    data = page.json()
-
+def _validate(data):
+    # Errors are reported with status 200, and must not replace the last good response in the cache
     if data["status"] != "OK":
         raise RuntimeError(data["error"])
 
-    return data["data"]
+@TTLCache(ttl=120)
+def request(page, addr):
+    url = f"https://api.ethermine.org/miner/{addr[2:]}/{page}"
+    data, fresh = http.get_json_entry(url, max_age=120, endpoint=f"ethermine/{page}", validate=_validate)
+
+    return data["data"] if fresh else Uncached(data["data"])
 
 def payouts(addr):
     return request("payouts", addr)
@@ -0,0 +1,163 @@
+"""Shared HTTP client for all pool and price APIs.
+
+One `requests.Session` keeps connections alive per host, so that repeated queries skip the TCP and TLS handshakes.
+Every request has connect and read timeouts, so that a hung endpoint can not block its caller forever.
+JSON responses are kept in a persistent cache, so that the last known values are available right after startup.
+"""
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import perf_counter, time
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import leprechaun as le
+from .diskcache import DiskCache, Entry
+
+
+class Client:
+    timeout = (5, 15)
+    """Default (connect, read) timeouts in seconds."""
+
+    def __init__(self, cache: DiskCache = None, pool_connections=8, pool_maxsize=8):
+        self.session = requests.Session()
+        self.session.headers.update({
+            "User-Agent": f"leprechaun/{le.__version__}",
+            "Accept-Encoding": "gzip, deflate",
+        })
+
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.overrides = {}
+        """Mapping of hosts to base URLs that replace them, for example {"api.ethermine.org": "http://127.0.0.1:8000"}.
+        Used to point the client at a local stub server.
+        """
+
+        self.cache = cache
+
+        self._latency = defaultdict(list)
+        self._lock = Lock()
+        self._refreshing = set()
+        self._executor_refresh = ThreadPoolExecutor(max_workers=2, thread_name_prefix="api-refresh")
+
+    def get(self, url, *, endpoint=None, **kwargs) -> requests.Response:
+        """Send a GET request and raise for HTTP errors.
+
+        `endpoint` is a name under which latency is recorded. By default, it is the host of the URL.
+        """
+        url = self._override(url)
+        endpoint = endpoint or urlsplit(url).netloc
+        kwargs.setdefault("timeout", self.timeout)
+
+        begin = perf_counter()
+        try:
+            response = self.session.get(url, **kwargs)
+        finally:
+            with self._lock:
+                latencies = self._latency[endpoint]
+                latencies.append(perf_counter() - begin)
+                del latencies[:-100]  # Keep only recent measurements
+
+        response.raise_for_status()
+        return response
+
+    def get_json(self, url, *, max_age, endpoint=None, validate=None):
+        """Return parsed JSON from a URL, using the persistent cache (stale-while-revalidate).
+
+        Entries confirmed less than `max_age` seconds ago are returned directly. Older entries are returned as well,
+        while a background request revalidates them using their `ETag` and `Last-Modified` headers. Only a URL that has
+        never been cached waits for the network.
+
+        `validate` is called with every response before it is cached, and raises for responses that must not be, such
+        as error payloads served with status 200.
+        """
+        return self.get_json_entry(url, max_age=max_age, endpoint=endpoint, validate=validate)[0]
+
+    def get_json_entry(self, url, *, max_age, endpoint=None, validate=None) -> tuple[object, bool]:
+        """Same as `get_json`, but return a tuple (data, fresh). `fresh` is False while the data is being
+        revalidated.
+        """
+        if self.cache is None:
+            data = self.get(url, endpoint=endpoint).json()
+            if validate is not None:
+                validate(data)
+            return data, True
+
+        entry = self.cache.get(url)
+        if entry is None:
+            return self._fetch(url, None, endpoint, validate), True
+
+        if time() - entry.fetched <= max_age:
+            return entry.data, True
+
+        with self._lock:
+            refresh = url not in self._refreshing
+            self._refreshing.add(url)
+
+        if refresh:
+            self._executor_refresh.submit(self._refresh, url, entry, endpoint, validate)
+
+        return entry.data, False
+
+    def _refresh(self, url, entry, endpoint, validate):
+        try:
+            self._fetch(url, entry, endpoint, validate)
+        except Exception:
+            pass  # Keep serving the cached value, and try again next time
+        finally:
+            with self._lock:
+                self._refreshing.discard(url)
+
+    def _fetch(self, url, entry: Entry, endpoint, validate=None):
+        """Fetch a URL into the cache, revalidating `entry` if there is one. Return parsed JSON."""
+        headers = {}
+        if entry is not None and entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry is not None and entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+
+        response = self.get(url, endpoint=endpoint, headers=headers)
+
+        if response.status_code == 304 and entry is not None:
+            self.cache.touch(url)
+            return entry.data
+
+        data = response.json()
+        if validate is not None:
+            validate(data)
+
+        self.cache.put(url, Entry(data, response.headers.get("ETag"), response.headers.get("Last-Modified"), time()))
+        return data
+
+    def latency(self) -> dict[str, dict[str, float]]:
+        """Return latency statistics in seconds per endpoint: count, last, mean and max of recent requests."""
+        with self._lock:
+            return {
+                endpoint: {
+                    "count": len(values),
+                    "last": values[-1],
+                    "mean": sum(values) / len(values),
+                    "max": max(values),
+                }
+                for endpoint, values in self._latency.items() if values
+            }
+
+    def _override(self, url):
+        parts = urlsplit(url)
+        if parts.netloc not in self.overrides:
+            return url
+
+        base = urlsplit(self.overrides[parts.netloc])
+        return urlunsplit((base.scheme, base.netloc, base.path.rstrip("/") + parts.path, parts.query, parts.fragment))
+
+
+client = Client(DiskCache(le.data_dir / "api-cache.sqlite3"))
+"""Client shared by all API modules."""
+
+get = client.get
+get_json = client.get_json
+get_json_entry = client.get_json_entry
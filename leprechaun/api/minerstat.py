@@ -1,17 +1,15 @@
-import sys
 from typing import Iterable
-import requests as rq
-from cachetools import cached, TTLCache
 
+from . import http
+from .cache import TTLCache, Uncached
 
-@cached(TTLCache(maxsize=sys.maxsize, ttl=60))
+
+@TTLCache(ttl=60)
 def _impl_stats(coins: str):
     """Query minerstat for coin information. Return unmodified data if no error was raised."""
     url = f"https://api.minerstat.com/v2/coins?list={coins}"
-    page = rq.get(url)
-    page.raise_for_status()
-    data = page.json()
-    return data
+    data, fresh = http.get_json_entry(url, max_age=60, endpoint="minerstat/coins")
+    return data if fresh else Uncached(data)
 
 def stats(coins: Iterable):
     """Query minerstat for coin information. Return a list of dicts with info.
@@ -1,17 +1,14 @@
-import sys
-import requests as rq
-from cachetools import cached, TTLCache
+from . import http
+from .cache import TTLCache, Uncached
 
 currency_precision = 12
 
-@cached(TTLCache(maxsize=sys.maxsize, ttl=60))
+@TTLCache(ttl=60)
 def stats(addr):
     url = f"https://supportxmr.com/api/miner/{addr}/stats"
-    page = rq.get(url)
-    page.raise_for_status()
-    data = page.json()
+    data, fresh = http.get_json_entry(url, max_age=60, endpoint="supportxmr/stats")
 
-    return data
+    return data if fresh else Uncached(data)
 
 def totalpaid(addr):
     data = stats(addr)
@@ -1,11 +1,13 @@
 import atexit
 import shutil
 import sys
+import warnings
 from collections import namedtuple
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, wait
 from functools import wraps
 from itertools import chain
 from pathlib import Path
+from time import monotonic
 
 import yaml
 from PySide6.QtCore import QCoreApplication, QTimer
@@ -16,9 +18,14 @@ from yaml.scanner import ScannerError as YamlScannerError
 
 import leprechaun as le
 from leprechaun import notepad
-from leprechaun.api import minerstat
-from leprechaun.miners import MinerStack
-from leprechaun.util import InvalidConfigError, format_exception, isroot, Signal
+from leprechaun.api import http, minerstat
+from leprechaun.benchmark import Calibration
+from leprechaun.conditions import Context
+from leprechaun.miners import BackendStore, CrashDumps, MinerStack, Provisioner
+from leprechaun.logsink import LogSink
+from leprechaun.scheduler import Scheduler
+from leprechaun.timeseries import TimeSeriesStore
+from leprechaun.util import ConfigWarning, InvalidConfigError, isroot, Signal
 from leprechaun.widgets import Dashboard, ExceptionMessageBox, Setup
 
 
@@ -27,7 +34,10 @@ Earnings = namedtuple("Earnings", ["total", "pending", "daily"])
 
 
 class CliApplication:
-    def __init__(self, config_path=None, pipe_log=False):
+    api_deadline = 10
+    """Seconds to wait for pool and price APIs while calculating earnings."""
+
+    def __init__(self, config_path=None, pipe_log=False, event_log=False):
         super().__init__()
 
         # Exception catching -------------------------------------------------------------------------------------------
@@ -38,12 +48,14 @@ class CliApplication:
         le.data_dir.mkdir(exist_ok=True)
         le.miners_dir.mkdir(exist_ok=True)
         le.miner_crashes_dir.mkdir(exist_ok=True)
+        le.miner_logs_dir.mkdir(exist_ok=True)
+        le.stats_dir.mkdir(exist_ok=True)
 
-        if pipe_log:
-            self._fp_log = open(le.data_dir / "log.txt", "a", encoding="utf-8", buffering=1)
-            atexit.register(self._fp_log.close)
-        else:
-            self._fp_log = sys.stdout
+        self.logsink = LogSink(
+            le.data_dir / "log.txt" if pipe_log else None,
+            le.data_dir / "events.jsonl" if event_log else None
+        )
+        atexit.register(self.logsink.close)
 
         self.log("Initializing")
         self.config_path = Path(config_path or "~/leprechaun.yml").expanduser()
@@ -53,6 +65,23 @@ class CliApplication:
         qapp.setApplicationName("leprechaun")
 
         # Miners -------------------------------------------------------------------------------------------------------
+        self.scheduler = Scheduler(self.update)
+        self.stats = TimeSeriesStore(le.stats_dir)
+        """Persistent hashrate and earnings history."""
+
+        self.executor_api = ThreadPoolExecutor(max_workers=8, thread_name_prefix="api")
+        """Bounded pool for concurrent pool and price queries."""
+        http.client.cache.onerror = lambda e: self.log("API cache is not available, querying the network:", e)
+
+        self.provisioner = Provisioner(self, BackendStore(le.miners_dir))
+
+        self.calibration = Calibration(le.data_dir / "calibration.json")
+        """Benchmark results, used as hashrates of miners that did not report one yet."""
+
+        self.crashdumps = CrashDumps(le.miner_crashes_dir)
+        """Compressed logs of miners that stopped unexpectedly."""
+        self.crashdumps.prune()
+
         self.cpuminers = MinerStack(self)
         self.gpuminers = MinerStack(self)
         self.cpuMinerChanged = Signal(str)
@@ -60,11 +89,8 @@ class CliApplication:
         self.cpuminers.onchange = self.cpuMinerChanged.emit
         self.gpuminers.onchange = self.gpuMinerChanged.emit
 
-        self.heartbeat = QTimer()
-        self.heartbeat.setInterval(5000)
-        self.heartbeat.timeout.connect(self.update)
-
         self.paused = False
+        self.paused_at = None
 
         # --------------------------------------------------------------------------------------------------------------
         if not isroot:
@@ -72,14 +98,37 @@ class CliApplication:
 
     def start(self):
         self.log("Starting")
+        self.event("start", version=le.__version__)
         self.loadconfig()
-        self.heartbeat.start()
         self.update()
 
     def update(self):
-        if not self.paused:
-            self.cpuminers.update()
-            self.gpuminers.update()
+        """Update miner stacks and schedule the next update for when something may change."""
+        if self.paused:
+            self.expire()
+            return
+
+        context = Context()
+        self.cpuminers.update(context)
+        self.gpuminers.update(context)
+
+        deadlines = (self.cpuminers.next_change(context), self.gpuminers.next_change(context))
+        self.scheduler.schedule(min((deadline for deadline in deadlines if deadline is not None), default=None))
+
+    def expire(self):
+        """Stop suspended miners that were kept for too long, and schedule the next time to do so.
+        Used instead of `update()` while mining is paused.
+        """
+        self.cpuminers.expire()
+        self.gpuminers.expire()
+
+        deadlines = (self.cpuminers.next_expiry(), self.gpuminers.next_expiry())
+        deadline = min((deadline for deadline in deadlines if deadline is not None), default=None)
+
+        if deadline is None:
+            self.scheduler.stop()
+        else:
+            self.scheduler.schedule(deadline)
 
     def loadconfig(self):
         with open(self.config_path, encoding="utf-8") as f:
@@ -93,81 +142,129 @@ class CliApplication:
                 if value == "<your address here>":
                     raise InvalidConfigError(f"placeholder address for '{currency}' currency")
 
-        self.cpuminers.loadconfig(config, "cpu")
-        self.gpuminers.loadconfig(config, "gpu")
+        # Pick up results of benchmarks that ran since the last load
+        self.calibration = Calibration(le.data_dir / "calibration.json")
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always", ConfigWarning)
+            self.cpuminers.loadconfig(config, "cpu")
+            self.gpuminers.loadconfig(config, "gpu")
+
+        for warning in caught:
+            if issubclass(warning.category, ConfigWarning):
+                self.log(f"Warning: {warning.message}")
+        self.provisioner.collect(chain(self.cpuminers.values(), self.gpuminers.values()))
+        self.prune_miner_logs()
 
         return config
 
+    def prune_miner_logs(self):
+        """Delete log files of miners that are no longer in the config."""
+        used = {miner.log.path for miner in chain(self.cpuminers.values(), self.gpuminers.values())}
+
+        for path in le.miner_logs_dir.glob("*.log"):
+            if path not in used:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass  # Opened by another instance, and deleted on a later load
+
     def earnings(self) -> Earnings:
         """Calculate earnings in USD from all miners.
 
         Returns a named tuple with properties `total`, `pending`, and `daily`. `daily` can be None if not possible to
         calculate at the moment.
+
+        All pool and price queries run concurrently. Pools that fail or do not answer within `api_deadline` are left
+        out of `total` and `pending`, so a slow provider makes the result partial instead of holding it up.
         """
-        currencies = {miner.currency for miner in chain(self.cpuminers.values(), self.gpuminers.values())}
+        miners = list(chain(self.cpuminers.values(), self.gpuminers.values()))
+        currencies = {miner.currency for miner in miners}
+
+        # One miner per distinct address is enough to query its earnings
+        address_miners = {(miner.currency, miner.address): miner for miner in miners}
+
+        future_info = self.executor_api.submit(minerstat.stats, currencies)
+        submit = self.executor_api.submit
+        futures_total = {key: submit(miner.earnings_total) for key, miner in address_miners.items()}
+        futures_pending = {key: submit(miner.earnings_pending) for key, miner in address_miners.items()}
+
+        wait([future_info, *futures_total.values(), *futures_pending.values()], timeout=self.api_deadline)
+
         try:
-            info = minerstat.stats(currencies)
-        except OSError as e:
+            info = {coin["coin"]: coin for coin in future_info.result(timeout=0)}
+        except Exception as e:
+            self.event("api-error", endpoint="minerstat", error=repr(e))
             raise RuntimeError("could not get currency information from minerstat") from e
-        info = {coin["coin"]: coin for coin in info}
 
-        used_addresses = set()
         total = 0
         pending = 0
         daily = 0
+        coins_total = dict.fromkeys(currencies, 0)
+        coins_pending = dict.fromkeys(currencies, 0)
+        incomplete = set()
 
-        for miner in chain(self.cpuminers.values(), self.gpuminers.values()):
+        for miner in miners:
             currency = miner.currency
-            address = miner.address
             price = info[currency]["price"]
             reward = info[currency]["reward"]  # Reward in coins per 1 H/s for one hour
             if info[currency]["reward_unit"] != currency:
                 raise RuntimeError("rewards in units that are not this currency are not supported")
 
+            if miner.running and not miner.suspended:
+                # Benchmarks fill in for miners that did not report a hashrate yet
+                hashrate = miner.expected_hashrate()
+                if hashrate is None:
+                    daily = None
+                elif daily is not None:
+                    daily += hashrate * reward * price * 24
+
+        for (currency, address), miner in address_miners.items():
             try:
-                if miner.running:
-                    hashrate = miner.hashrate()
-                    if hashrate is None:
-                        daily = None
-                    elif daily is not None:
-                        daily += miner.hashrate() * reward * price * 24
-
-                if (currency, address) not in used_addresses:
-                    total += miner.earnings_total() * price
-                    pending += miner.earnings_pending() * price
-                    used_addresses.add((currency, address))
-            except OSError as e:
-                raise RuntimeError(f"could not get earnings of miner '{miner.name}'") from e
+                earned_total = futures_total[currency, address].result(timeout=0)
+                earned_pending = futures_pending[currency, address].result(timeout=0)
+            except TimeoutError:
+                self.log(f"Earnings of miner '{miner.name}' did not arrive in {self.api_deadline}s, leaving them out")
+                self.event("api-timeout", miner=miner.name, duration=self.api_deadline)
+                incomplete.add(currency)
+            except Exception as e:
+                # Besides network errors, a provider may report an error or change its payload. Only it is left out
+                self.log(f"Could not get earnings of miner '{miner.name}', leaving them out:", e)
+                self.event("api-error", miner=miner.name, error=repr(e))
+                incomplete.add(currency)
+            else:
+                coins_total[currency] += earned_total
+                coins_pending[currency] += earned_pending
+
+        for currency in currencies:
+            total += coins_total[currency] * info[currency]["price"]
+            pending += coins_pending[currency] * info[currency]["price"]
+
+            if currency not in incomplete:
+                self.stats.series("earnings", currency, "total").append(coins_total[currency])
+                self.stats.series("earnings", currency, "pending").append(coins_pending[currency])
 
         return Earnings(total, pending, daily)
 
     def exit(self, code=0):
         self.log("Exiting")
+        self.event("exit", code=code)
 
-        self.cpuminers.stop()
-        self.gpuminers.stop()
+        self.scheduler.stop()
+        self.cpuminers.shutdown()
+        self.gpuminers.shutdown()
+        self.executor_api.shutdown(wait=False, cancel_futures=True)
+        self.provisioner.shutdown()
+        self.crashdumps.shutdown()
 
         QCoreApplication.instance().exit(code)
 
-    def format_log(self, *args):
-        timestamp = f"[{datetime.now().isoformat(' ', 'milliseconds')}] "
-        padding = " " * len(timestamp)
-        prefix = timestamp
-
-        for arg in args:
-            if isinstance(arg, BaseException):
-                external_lines = format_exception(None, arg, arg.__traceback__)
-                lines = (line for external_line in external_lines for line in external_line[:-1].splitlines())
-            else:
-                lines = str(arg).splitlines()
-
-            for line in lines:
-                yield f"{prefix}{line}\n"
-                prefix = padding
-
     def log(self, *args):
-        for line in self.format_log(*args):
-            self._fp_log.write(line)
+        self.logsink.log(*args)
+
+    def event(self, kind, **fields):
+        """Record a structured event in the event log, if it is enabled."""
+        self.logsink.event(kind, **fields)
 
     def excepthook(self, etype, value, tb):
         if isinstance(value, KeyboardInterrupt):
@@ -236,6 +333,7 @@ class Application(CliApplication):
     def _impl_start(self):
         """User-facing action triggered on program launch."""
         self.log("Starting")
+        self.event("start", version=le.__version__)
 
         try:
             self.loadconfig()
@@ -254,23 +352,22 @@ class Application(CliApplication):
                 return
 
         self.system_icon.show()
-        self.heartbeat.start()
         self.update()
 
     def update(self):
         super().update()
 
         # Status -------------------------------------------------------------------------------------------------------
-        if self.cpuminers.active:
-            if self.gpuminers.active:
-                status = f"{self.cpuminers.active.name} && {self.gpuminers.active.name}"
-            else:
-                status = self.cpuminers.active.name
+        working = self.cpuminers.working + self.gpuminers.working
+
+        if self.paused:
+            status = "Mining paused"
+        elif working:
+            status = " && ".join(miner.name for miner in working)
+        elif self.provisioner.total_progress() is not None:
+            status = f"Downloading miners ({self.provisioner.total_progress():.0%})"
         else:
-            if self.gpuminers.active:
-                status = self.gpuminers.active.name
-            else:
-                status = "No active miners"
+            status = "No active miners"
 
         self.system_icon_status.setText(status)
 
@@ -301,10 +398,13 @@ class Application(CliApplication):
 
     def actionPauseMining(self, duration):
         self.log(f"Mining paused for {duration}s")
+        self.event("pause", duration=duration)
         self.paused = True
+        self.paused_at = monotonic()
 
         self.cpuminers.stop()
         self.gpuminers.stop()
+        self.expire()
 
         self.system_icon_status.setText("Mining paused")
         self.menu_pause.menuAction().setVisible(False)
@@ -314,7 +414,11 @@ class Application(CliApplication):
         QTimer.singleShot(duration * 1000, self.actionResumeMining)
 
     def actionResumeMining(self):
+        if not self.paused:
+            return
+
         self.log("Mining resumed")
+        self.event("resume", paused=monotonic() - self.paused_at)
         self.paused = False
 
         self.menu_pause.menuAction().setVisible(True)
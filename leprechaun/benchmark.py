@@ -0,0 +1,164 @@
+"""Measuring what configured miners achieve on this machine.
+
+`leprechaun benchmark` runs miners one at a time and saves results into a calibration file. The application uses them
+as the expected hashrate of miners that have not reported a hashrate yet.
+"""
+import json
+import os
+import subprocess as sp
+from collections import namedtuple
+from datetime import datetime
+from pathlib import Path
+from time import monotonic, sleep
+from typing import Iterable, Optional
+
+import yaml
+
+import leprechaun as le
+from leprechaun.miners import BackendStore, Miner, miner as make_miner
+from leprechaun.util import cpu_time, InvalidConfigError, peak_memory_usage
+
+BenchmarkResult = namedtuple(
+    "BenchmarkResult", ["hashrate", "cpu_time", "peak_memory", "warmup", "duration", "backend", "threads", "time"]
+)
+"""Result of benchmarking a miner.
+
+`hashrate` is the average reported during the measurement, in H/s and before fees. `cpu_time` is CPU time used during
+the measurement in seconds, and `peak_memory` is the largest resident set size in bytes. `backend` and `threads` record
+the backend and CPU thread count that were measured, so that results for other settings are not used.
+"""
+
+
+class Calibration:
+    """Benchmark results, stored in a JSON file by miner stack and name."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.results: dict[str, BenchmarkResult] = {}
+
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return  # A missing or unreadable file is as good as none, and is replaced on the next save
+
+        for key, fields in data.items():
+            try:
+                self.results[key] = BenchmarkResult(**fields)
+            except TypeError:
+                pass  # Written by a different version
+
+    def get(self, type, miner: Miner) -> Optional[BenchmarkResult]:
+        """Return the result for a miner, if it was measured with the same backend and thread count."""
+        result = self.results.get(f"{type}/{miner.name}")
+        if result is None:
+            return None
+
+        if result.backend != miner.required_backend().name or result.threads != getattr(miner, "process_threads", None):
+            return None
+        return result
+
+    def set(self, type, name, result: BenchmarkResult):
+        self.results[f"{type}/{name}"] = result
+
+    def save(self):
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({key: result._asdict() for key, result in self.results.items()}, f, indent=2)
+        os.replace(temp_path, self.path)
+
+
+def benchmark(miner: Miner, warmup: float, duration: float) -> BenchmarkResult:
+    """Run a miner for `warmup` seconds, then measure it for `duration` seconds. The backend must be installed."""
+    miner.start()
+    process = miner.running_process
+
+    try:
+        _wait(miner, warmup)
+        cpu_time_begin = cpu_time(process)
+        _wait(miner, duration)
+        cpu_time_end = cpu_time(process)
+        peak_memory = peak_memory_usage(process)
+
+        # Samples taken during warmup do not count. Taken before stopping, so that shutdown does not shorten the window
+        hashrate = miner.metrics.hashrate.mean(duration)
+    finally:
+        miner.stop()
+        try:
+            process.wait(10)
+        except sp.TimeoutExpired:
+            miner.kill()
+            process.wait()
+
+    return BenchmarkResult(
+        hashrate=hashrate,
+        cpu_time=cpu_time_end - cpu_time_begin if cpu_time_begin is not None and cpu_time_end is not None else None,
+        peak_memory=peak_memory,
+        warmup=warmup,
+        duration=duration,
+        backend=miner.required_backend().name,
+        threads=getattr(miner, "process_threads", None),
+        time=datetime.now().isoformat(timespec="seconds"),
+    )
+
+
+def run(config_path, names: Iterable[str] = (), warmup=60.0, duration=120.0):
+    """Benchmark miners from a config file, or only those in `names`, and save results into the calibration file."""
+    with open(config_path, encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+
+    names = set(names)
+    miners = []
+    for type in ("cpu", "gpu"):
+        for name, data in config.get(f"{type}-miners", {}).items():
+            if names and name not in names:
+                continue
+
+            try:
+                miners.append((type, make_miner(type, name, data, config)))
+            except InvalidConfigError as e:
+                raise InvalidConfigError(f"{type.upper()} miner '{name}': {e}") from None
+
+    unknown = names - {miner.name for _, miner in miners}
+    if unknown:
+        raise InvalidConfigError(f"no miners named: {', '.join(sorted(unknown))}")
+
+    le.miners_dir.mkdir(parents=True, exist_ok=True)
+    store = BackendStore(le.miners_dir)
+    calibration = Calibration(le.data_dir / "calibration.json")
+
+    for type, miner in miners:
+        print(f"Benchmarking {type.upper()} miner '{miner.name}' ({warmup:g}s warmup, {duration:g}s measurement)")
+
+        try:
+            backend = miner.required_backend()
+            miner.backend_dir = store.lookup(backend)
+            if miner.backend_dir is None:
+                print(f"  Downloading backend '{backend.name}'")
+                miner.backend_dir = store.install(backend)
+
+            if miner.needs_tuning:
+                print("  Tuning")
+                miner.tune(miner.backend_dir, lambda message: print(f"  {message}"))
+
+            result = benchmark(miner, warmup, duration)
+        except (OSError, RuntimeError) as e:
+            print(f"  Failed: {e}")
+            continue
+
+        print(
+            "  Hashrate: " + (f"{result.hashrate:.1f} H/s" if result.hashrate is not None else "not reported") +
+            (f", CPU time: {result.cpu_time:.1f}s" if result.cpu_time is not None else "") +
+            (f", peak memory: {result.peak_memory / 2**20:.0f} MiB" if result.peak_memory is not None else "")
+        )
+
+        calibration.set(type, miner.name, result)
+        calibration.save()
+
+
+def _wait(miner: Miner, seconds):
+    deadline = monotonic() + seconds
+    while monotonic() < deadline:
+        if not miner.running:
+            raise RuntimeError(f"miner exited with code {miner.returncode}")
+        sleep(min(1.0, max(0.0, deadline - monotonic())))
@@ -1,12 +1,14 @@
 import operator
+import warnings
 from abc import ABC, abstractmethod
-from datetime import date, datetime, time, timedelta
-from decimal import Decimal, getcontext
-from functools import reduce
+from bisect import bisect_right
+from datetime import datetime, time, timedelta
+from functools import cached_property, reduce
+from typing import Optional
 
 from idle import idle
 
-from .util import InvalidConfigError, calc
+from .util import ConfigWarning, InvalidConfigError, parse_duration
 
 
 def condition(data):
@@ -23,39 +25,170 @@ def condition(data):
     if data["condition"] == "on-schedule":
         return ScheduleCondition(data)
 
+class Context:
+    """A snapshot of the outside world, shared by all conditions during one scheduling pass.
+
+    Every value is sampled at most once, and only when a condition actually needs it.
+    """
+
+    @cached_property
+    def now(self) -> datetime:
+        return datetime.now()
+
+    @cached_property
+    def minute(self) -> int:
+        """Minute of the week, see `WeeklyIntervals`."""
+        return WeeklyIntervals.minute(self.now)
+
+    @cached_property
+    def idle(self) -> float:
+        """User idle time in seconds."""
+        return idle()
+
+
 class Condition(ABC):
+    intervals: Optional["WeeklyIntervals"] = None
+    """Weekly intervals during which this condition is satisfied, if they are known at config load."""
+
     @abstractmethod
-    def satisfied(self) -> bool:
+    def satisfied(self, context: Context) -> bool:
         pass
 
+    @abstractmethod
+    def next_change(self, context: Context) -> Optional[datetime]:
+        """Return the earliest moment after `context.now` when the value of `satisfied()` may change.
+
+        Returns None if the value never changes on its own. The returned moment may be earlier than the actual change,
+        but never later.
+        """
+
 
 class WhenIdleCondition(Condition):
     def __init__(self, data):
         if "idle-time" not in data:
             raise InvalidConfigError("when-idle condition missing 'idle-time' field")
 
-        # Using decimal here for precision and to track that a suffix was applied
-        getcontext().prec = 3
-        idle_time = calc(data["idle-time"], unary_operators={
-            ("s",  "postfix"): Decimal,
-            ("ms", "postfix"): lambda val: Decimal(val) / 1000,
-            ("m",  "postfix"): lambda val: Decimal(val) * 60,
-            ("h",  "postfix"): lambda val: Decimal(val) * 60 * 60,
-            ("d",  "postfix"): lambda val: Decimal(val) * 60 * 60 * 24,
-        })
-        if not isinstance(idle_time, Decimal):
-            raise InvalidConfigError("invalid type for 'idle-time' field (use ms, s, m, h, d suffixes to designate time)")
-
+        idle_time = parse_duration(data, "idle-time")
         if idle_time <= 0:
             raise InvalidConfigError(f"'idle-time' field must be above 0 (got '{data['idle-time']})'")
 
-        self.timeout = float(idle_time)
+        self.timeout = idle_time
+
+    poll_interval = timedelta(seconds=1)
+    """The user can come back at any moment, and the only way to notice that is to ask again. Miners should stop
+    within about a second of the user's return, so this is not made longer to save wakeups.
+    """
+
+    def satisfied(self, context):
+        return context.idle >= self.timeout
+
+    def next_change(self, context):
+        if context.idle < self.timeout:
+            # Input resets the idle time, so the condition can not become satisfied any sooner than this
+            return context.now + timedelta(seconds=self.timeout - context.idle)
+        return context.now + self.poll_interval
+
+
+class WeeklyIntervals:
+    """A set of time intervals within a week, with one minute precision.
+
+    The set is stored as a sorted list of edges, measured in minutes since Monday 00:00. Every pair of edges is a
+    half-open interval `[start, end)`. Intervals that wrap around from Sunday to Monday are split in two.
+    """
+
+    length = 7 * 24 * 60
+
+    def __init__(self, intervals=()):
+        """Create an interval set from (start, end) pairs. `end` may exceed `length` to wrap around the week."""
+        edges = []
+
+        for start, end in sorted(self._split(intervals)):
+            if edges and start <= edges[-1]:
+                # Overlaps or touches the previous interval
+                edges[-1] = max(edges[-1], end)
+            else:
+                edges += [start, end]
+
+        self.edges = edges
+
+    @classmethod
+    def _split(cls, intervals):
+        for start, end in intervals:
+            if end - start >= cls.length:
+                yield 0, cls.length
+                continue
+
+            start %= cls.length
+            end = start + (end - start) % cls.length
+
+            if end > cls.length:
+                yield start, cls.length
+                yield 0, end - cls.length
+            elif start < end:
+                yield start, end
+
+    @staticmethod
+    def minute(moment: datetime) -> int:
+        """Return the minute of the week for a moment in time."""
+        return moment.weekday() * 24 * 60 + moment.hour * 60 + moment.minute
+
+    def contains(self, minute: int) -> bool:
+        return bisect_right(self.edges, minute) % 2 == 1
+
+    def next_edge(self, minute: int) -> Optional[int]:
+        """Return the first minute after `minute` at which membership changes, possibly beyond `length` if the change
+        happens next week. Return None if membership never changes.
+        """
+        if not self.edges or self.edges == [0, self.length]:
+            return None
+
+        i = bisect_right(self.edges, minute)
+        if i == len(self.edges):
+            return self.length + self.edges[0]
+
+        edge = self.edges[i]
+        if edge == self.length and self.edges[0] == 0:
+            # The interval continues from Monday 00:00, so the end of the week is not a real edge
+            edge += self.edges[1]
+
+        return edge
+
+    def _combine(self, other, op):
+        points = sorted(set(self.edges) | set(other.edges) | {0})
+        bounds = zip(points, points[1:] + [self.length])
 
-    def satisfied(self):
-        return idle() >= self.timeout
+        return WeeklyIntervals(
+            (start, end) for start, end in bounds if start < end and op(self.contains(start), other.contains(start))
+        )
 
+    def __or__(self, other):
+        return self._combine(other, operator.or_)
 
-class ScheduleCondition(Condition):
+    def __and__(self, other):
+        return self._combine(other, operator.and_)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({list(zip(self.edges[::2], self.edges[1::2]))})"
+
+
+class IntervalCondition(Condition):
+    """Condition satisfied during a fixed set of weekly intervals. Other conditions compile to this at config load."""
+
+    def __init__(self, intervals: WeeklyIntervals):
+        self.intervals = intervals
+
+    def satisfied(self, context):
+        return self.intervals.contains(context.minute)
+
+    def next_change(self, context):
+        edge = self.intervals.next_edge(context.minute)
+
+        if edge is None:
+            return None
+        return context.now.replace(second=0, microsecond=0) + timedelta(minutes=edge - context.minute)
+
+
+class ScheduleCondition(IntervalCondition):
     week = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
 
     def __init__(self, data):
@@ -70,39 +203,32 @@ class ScheduleCondition(Condition):
                 except ValueError:
                     raise InvalidConfigError(f"unknown day '{day}'") from None
 
-        self.days = [self.week.index(day) for day in data["days"]]
+        self.from_time = self._parse_time(data, "from-time")
+        self.until_time = self._parse_time(data, "until-time")
 
-        try:
-            self.from_time = time.fromisoformat(data.get("from-time", "00:00"))
-        except (TypeError, ValueError):
-            raise InvalidConfigError(f"invalid value for field 'from-time' (got '{data['from-time']}')") from None
+        # Compile into weekly intervals. An overnight window belongs to the day it starts on.
+        from_minute = self.from_time.hour * 60 + self.from_time.minute
+        until_minute = self.until_time.hour * 60 + self.until_time.minute
+        if until_minute <= from_minute:
+            until_minute += 24 * 60
+
+        super().__init__(WeeklyIntervals(
+            (day * 24 * 60 + from_minute, day * 24 * 60 + until_minute) for day in self.days
+        ))
 
+    @staticmethod
+    def _parse_time(data, field):
         try:
-            self.until_time = time.fromisoformat(data.get("until-time", "00:00"))
+            result = time.fromisoformat(data.get(field, "00:00"))
         except (TypeError, ValueError):
-            raise InvalidConfigError(f"invalid value for field 'until-time' (got '{data['until-time']}')") from None
-
-    def satisfied(self):
-        now = datetime.now()
-
-        if now.weekday() not in self.days:
-            return False
-
-        if self.from_time == self.until_time:
-            return True
-
-        today = date.today()
+            raise InvalidConfigError(f"invalid value for field '{field}' (got '{data[field]}')") from None
 
-        from_datetime = datetime.combine(today, self.from_time)
-        until_datetime = datetime.combine(today, self.until_time)
+        if result.second != 0 or result.microsecond != 0:
+            # Schedules have one minute precision. Older versions accepted seconds, so such configs still load
+            warnings.warn(f"seconds in field '{field}' are ignored (got '{data[field]}')", ConfigWarning)
+            result = result.replace(second=0, microsecond=0)
 
-        if self.from_time < self.until_time:
-            return from_datetime <= now < until_datetime
-
-        todaybegin = datetime.combine(today, time.min)
-        tomorrowbegin = datetime.combine(today + timedelta(days=1), time.min)
-
-        return todaybegin <= now < until_datetime or from_datetime <= now < tomorrowbegin
+        return result
 
 
 class AndCondition(Condition):
@@ -118,8 +244,18 @@ class AndCondition(Condition):
             cond = condition(entry)
             self.components.append(cond)
 
-    def satisfied(self):
-        return reduce(operator.and_, (component.satisfied() for component in self.components), True)
+        self.components, self.intervals = _compile(self.components, operator.and_)
+
+    def satisfied(self, context):
+        return all(component.satisfied(context) for component in self.components)
+
+    def next_change(self, context):
+        for component in self.components:
+            if not component.satisfied(context):
+                # Nothing changes until this component is satisfied
+                return component.next_change(context)
+
+        return _earliest(component.next_change(context) for component in self.components)
 
 
 class OrCondition(Condition):
@@ -132,5 +268,36 @@ class OrCondition(Condition):
             cond = condition(entry)
             self.components.append(cond)
 
-    def satisfied(self):
-        return reduce(operator.or_, (component.satisfied() for component in self.components), False)
+        self.components, self.intervals = _compile(self.components, operator.or_)
+
+    def satisfied(self, context):
+        return any(component.satisfied(context) for component in self.components)
+
+    def next_change(self, context):
+        for component in self.components:
+            if component.satisfied(context):
+                # Nothing changes until this component stops being satisfied
+                return component.next_change(context)
+
+        return _earliest(component.next_change(context) for component in self.components)
+
+
+def _compile(components, op):
+    """Merge all components that are known at config load into one interval condition, placed first so that it is
+    evaluated before more expensive conditions.
+
+    Return new components and the interval set of the whole condition, or None if it contains other conditions.
+    """
+    compiled = [component.intervals for component in components if component.intervals is not None]
+    if not compiled:
+        return components, None
+
+    intervals = reduce(op, compiled)
+    rest = [component for component in components if component.intervals is None]
+
+    return [IntervalCondition(intervals)] + rest, (intervals if not rest else None)
+
+
+def _earliest(moments):
+    """Return the earliest of several moments, ignoring Nones. Return None if there are none."""
+    return min((moment for moment in moments if moment is not None), default=None)
@@ -0,0 +1,192 @@
+"""Application log, written from a background thread.
+
+Callers only put records on a queue. Formatting and I/O happen in the writer thread, so that logging never blocks the
+GUI or the scheduler.
+"""
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+from queue import SimpleQueue
+from threading import Thread
+from time import time
+
+from leprechaun.util import format_exception
+
+
+def format_record(timestamp: datetime, args):
+    """Format a human-readable log record. Yields lines; continuation lines are aligned under the first one."""
+    timestamp = f"[{timestamp.isoformat(' ', 'milliseconds')}] "
+    padding = " " * len(timestamp)
+    prefix = timestamp
+
+    for arg in args:
+        if isinstance(arg, BaseException):
+            external_lines = format_exception(None, arg, arg.__traceback__)
+            lines = (line for external_line in external_lines for line in external_line[:-1].splitlines())
+        else:
+            lines = str(arg).splitlines()
+
+        for line in lines:
+            yield f"{prefix}{line}\n"
+            prefix = padding
+
+
+class RotatingFile:
+    """Text file that is rotated when it grows over `max_bytes` or gets older than `max_age`.
+
+    Rotated files are renamed to `<name>.1`, `<name>.2`, and so on, and only `backups` of them are kept. The creation
+    time of the current file is kept in `<name>.created`, since file systems do not reliably record it.
+    """
+
+    def __init__(self, path, max_bytes=10 << 20, max_age=timedelta(days=7), backups=5):
+        self.path = Path(path)
+        self.created_path = self.path.with_name(self.path.name + ".created")
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.backups = backups
+        self._open()
+
+    def write(self, text):
+        if self._file.closed:
+            self._open()  # A previous rotation failed halfway
+
+        if self.size >= self.max_bytes or time() - self.created > self.max_age.total_seconds():
+            self.rotate()
+
+        data = text.encode("utf-8")
+        self._file.write(data)
+        self.size += len(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def rotate(self):
+        self._file.close()
+
+        for i in range(self.backups - 1, 0, -1):
+            source = self.path.with_name(f"{self.path.name}.{i}")
+            if source.exists():
+                os.replace(source, self.path.with_name(f"{self.path.name}.{i + 1}"))
+
+        if self.backups > 0:
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink()
+
+        self._open()
+
+    def close(self):
+        self._file.close()
+
+    def _open(self):
+        self._file = open(self.path, "ab")
+        stat = os.stat(self._file.fileno())
+        self.size = stat.st_size
+
+        if self.size > 0:
+            try:
+                self.created = float(self.created_path.read_text())
+                return
+            except (OSError, ValueError):
+                # Written by an older version. The last write is the best estimate left, and errs on the late side
+                self.created = stat.st_mtime
+        else:
+            self.created = time()
+
+        try:
+            self.created_path.write_text(repr(self.created))
+        except OSError:
+            pass  # Only makes the next start rotate later
+
+
+class LogSink:
+    """Queue-based writer of the human-readable log and an optional stream of structured events.
+
+    The log is written to `log_path`, or to stdout if it is None. Events are written to `events_path` as JSON lines,
+    if it is specified. Both files are rotated by size and age.
+    """
+
+    def __init__(self, log_path=None, events_path=None):
+        self._log = RotatingFile(log_path) if log_path is not None else None
+        self._events = RotatingFile(events_path) if events_path is not None else None
+
+        self._queue = SimpleQueue()
+        self._failing = False
+        self._thread = Thread(target=self._run, name="log", daemon=True)
+        self._thread.start()
+
+    def log(self, *args):
+        """Write a human-readable record. Exceptions in `args` are formatted with their tracebacks."""
+        self._queue.put(("log", datetime.now(), args))
+
+    def event(self, kind, **fields):
+        """Write a structured event, such as "switch" or "crash". Durations in `fields` should be in seconds."""
+        if self._events is not None:
+            self._queue.put(("event", datetime.now(), (kind, fields)))
+
+    def close(self):
+        """Write all queued records and stop the writer thread."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            records = [self._queue.get()]
+
+            # Write everything that is already queued before flushing
+            while not self._queue.empty():
+                records.append(self._queue.get())
+
+            stop = False
+            for record in records:
+                if record is None:
+                    stop = True
+                else:
+                    self._guard(self._write, *record)
+
+            self._guard(self._flush)
+
+            if stop:
+                break
+
+        if self._log is not None:
+            self._guard(self._log.close)
+        if self._events is not None:
+            self._guard(self._events.close)
+
+    def _guard(self, fn, *args):
+        """Call `fn`, reporting the first of consecutive I/O errors to stderr. A full disk or a file that can not be
+        opened must not stop the writer thread, or every later record would stay in the queue.
+        """
+        try:
+            fn(*args)
+        except (OSError, ValueError) as e:
+            if not self._failing and sys.stderr is not None:
+                sys.stderr.write(f"Could not write the application log: {e!r}\n")
+            self._failing = True
+        else:
+            self._failing = False
+
+    def _write(self, kind, timestamp, payload):
+        if kind == "log":
+            for line in format_record(timestamp, payload):
+                if self._log is not None:
+                    self._log.write(line)
+                else:
+                    sys.stdout.write(line)
+        else:
+            event, fields = payload
+            record = {"time": timestamp.isoformat(timespec="milliseconds"), "event": event, **fields}
+            self._events.write(json.dumps(record, default=str) + "\n")
+
+    def _flush(self):
+        if self._log is not None:
+            self._log.flush()
+        else:
+            sys.stdout.flush()
+
+        if self._events is not None:
+            self._events.flush()
@@ -1,21 +1,45 @@
 from collections.abc import MutableMapping
 from typing import Union, Optional, Callable
-from datetime import datetime
+import multiprocessing
+import subprocess as sp
+from datetime import datetime, timedelta
+from itertools import chain
+from time import monotonic
+
+from PySide6.QtCore import QTimer
 
 import leprechaun as le
-from leprechaun.util import InvalidConfigError
+from leprechaun.conditions import Context
+from leprechaun.util import calc, InvalidConfigError, parse_duration
 from .xmr import XmrMiner
 from .eth import EthMiner
+from .allocator import allocate_threads, ThreadDemand
 from .base import Miner
+from .handover import Handover
+from .logring import CrashDumps, LogRing
+from .profit import ProfitPolicy
+from .provisioner import Provisioner
+from .store import BackendStore
 
 class MinerStack(MutableMapping):
     def __init__(self, app):
         super().__init__()
         self.app = app
 
+        self.type = None
+        self.mode = "single"
+        """Either "single", where one miner works at a time, or "shared", where miners split CPU threads."""
+        self.policy: Optional[ProfitPolicy] = None
+        """Picks the working miner in "single" mode. If None, the first eligible miner is picked."""
         self.miners: dict[str, Miner] = {}
         self.active_name: Optional[str] = None
+        self.handover: Optional[Handover] = None
+        """Switch between miners in progress."""
         self.onswitch: Optional[Callable] = None
+        self.allocation: dict[str, int] = {}
+        """Thread counts that miners should run with in "shared" mode, by miner name."""
+        self.threads: dict[str, int] = {}
+        """Thread counts of miners started in "shared" mode, by miner name."""
 
     @property
     def active(self):
@@ -28,6 +52,11 @@ class MinerStack(MutableMapping):
         else:
             self.active_name = value.name
 
+    @property
+    def working(self) -> list[Miner]:
+        """Miners that are running and not suspended."""
+        return [miner for miner in self.values() if miner.running and not miner.suspended]
+
     def loadconfig(self, config, type: Union["cpu", "gpu"]):
         if type == "cpu":
             data = config.get("cpu-miners", {})
@@ -36,7 +65,39 @@ class MinerStack(MutableMapping):
         else:
             raise ValueError("Unknown value for parameter 'type'")
 
+        stack_data = config.get(f"{type}-stack", {})
+        mode = stack_data.get("mode", "single")
+        if mode not in ("single", "shared"):
+            raise InvalidConfigError(f"{type.upper()} stack mode must be one of: 'single', 'shared' (got '{mode}')")
+        if mode == "shared" and type != "cpu":
+            raise InvalidConfigError("only the CPU stack can be shared between miners")
+
+        policy = stack_data.get("policy", "first")
+        if policy not in ("first", "most-profitable"):
+            raise InvalidConfigError(
+                f"{type.upper()} stack policy must be one of: 'first', 'most-profitable' (got '{policy}')"
+            )
+        if policy != "first" and mode == "shared":
+            raise InvalidConfigError("a shared stack runs every eligible miner, and can not have a policy")
+
+        self.type = type
+        self._retire()
         self.clear()
+        self.mode = mode
+        self.policy = None
+
+        if policy == "most-profitable":
+            self.policy = ProfitPolicy(self.app)
+
+            try:
+                self.policy.margin = calc(stack_data.get("switch-margin", self.policy.margin))
+            except ValueError:
+                raise InvalidConfigError("invalid expression in field 'switch-margin'") from None
+            if not self.policy.margin >= 0:
+                raise InvalidConfigError(f"switch margin must not be negative (got '{self.policy.margin}')")
+
+            if "min-dwell" in stack_data:
+                self.policy.min_dwell = timedelta(seconds=parse_duration(stack_data, "min-dwell"))
 
         for miner_name, miner_data in data.items():
             try:
@@ -44,32 +105,89 @@ class MinerStack(MutableMapping):
             except InvalidConfigError as e:
                 raise InvalidConfigError(f"{type.upper()} miner '{miner_name}': {e}") from None
 
-    def update(self):
+            # A finished process means that the stack may need to switch miners right away
+            self[miner_name].processFinished.connect(self._impl_onfinished)
+            self[miner_name].history = self.app.stats.series("hashrate", type, miner_name)
+            self[miner_name].log = LogRing(le.miner_logs_dir / f"{type}-{miner_name}.log")
+            self[miner_name].calibration = self.app.calibration.get(type, self[miner_name])
+
+        # Backends are installed in the background, miners become eligible as soon as theirs is ready
+        for miner_object in self.values():
+            self.app.provisioner.provision(miner_object)
+
+    def update(self, context: Context = None):
         """Traverse the stack and maybe switch the miner for another miner."""
-        active = self.active
+        context = context or Context()
+        self.expire(context)
 
-        if active is not None and not active.running:
-            active.broken = True
+        if self.handover is not None:
+            return  # Decided again once the handover completes
+
+        if self.mode == "shared":
+            self._update_shared(context)
+            return
 
-            log_filename = f"[{datetime.now().isoformat(' ', 'milliseconds').replace(':', '.')}] {active.name}.txt"
-            log_path = le.miner_crashes_dir / log_filename
-            with open(log_path, "w", encoding="utf-8") as f:
-                for line in active.log:
-                    f.write(line + "\n")
+        active = self.active
 
-            self.app.log(f"Miner '{active.name}' stopped unexpectedly.\nMiner log available as '{log_filename}'")
+        if active is not None and not active.running:
+            # The supervisor holds the miner back, and the loop below fails over to the next eligible one
+            self.active = None
+            self._crashed(active)
 
-        for name, miner in self.items():
-            if miner.enabled and miner.allowed and not miner.broken:
-                if self.active_name != name:
-                    self.switch(miner)
+        eligible = self.eligible(context)
 
-                break
+        if self.policy is not None:
+            chosen = self.policy.choose(eligible, self.active, context.now)
         else:
+            chosen = eligible[0] if eligible else None
+
+        if chosen is None:
             self.stop()
+        elif self.active_name != chosen.name:
+            self.switch(chosen)
+
+    def eligible(self, context: Context) -> list[Miner]:
+        """Return miners that are allowed to work right now, in stack order."""
+        return [
+            miner for miner in self.values()
+            if miner.enabled and miner.ready and not miner.broken and miner.allowed(context)
+        ]
+
+    def next_change(self, context: Context) -> Optional[datetime]:
+        """Return the earliest moment when the result of `update()` may change, or None if it only changes on external
+        events.
+        """
+        deadlines = chain(
+            (
+                miner.condition.next_change(context) for miner in self.values()
+                if miner.enabled and miner.ready and not miner.broken and miner.condition is not None
+            ),
+            # Crashed miners are retried once their backoff runs out
+            (miner.supervisor.retry_at for miner in self.values() if miner.enabled and miner.broken),
+            (self.next_expiry(),),
+            (self.policy.next_change() if self.policy is not None else None,),
+        )
+        return min((deadline for deadline in deadlines if deadline is not None), default=None)
+
+    def expire(self, context: Context = None):
+        """Stop suspended miners that were kept for longer than their `suspend_timeout`."""
+        now = (context or Context()).now
+
+        for miner in self.values():
+            if miner.suspended and miner.suspended_until <= now:
+                self.app.log(f"Stopping miner '{miner.name}', which was suspended for {miner.suspend_timeout}")
+                self._release(miner, suspend=False)
+
+    def next_expiry(self) -> Optional[datetime]:
+        """Return the moment when the next suspended miner must be stopped, or None if there are none."""
+        return min((miner.suspended_until for miner in self.values() if miner.suspended), default=None)
 
     def switch(self, new_miner: Union[str, Miner, None]):
-        """Switch to a new miner."""
+        """Switch to a new miner.
+
+        Old miners are stopped and have exited before the new miner starts (see `Handover`), so the switch may complete
+        after this function returns. A miner that is not replaced by anything is suspended if possible.
+        """
         active = self.active
 
         if isinstance(new_miner, str):
@@ -78,23 +196,215 @@ class MinerStack(MutableMapping):
         if active != new_miner:
             self.app.log(f"Switching from {active.name if active else None} to {new_miner.name if new_miner else None}")
 
-        if active is not None:
-            active.stop()
+        if new_miner is None and active is not None and active.suspend():
+            # Nothing else needs the hardware, so the miner can pick up where it left off
+            self.app.log(f"Suspended miner '{active.name}'")
+            self.active = None
+            self._impl_onswitch(active, None)
+            return
+
+        # Suspended miners hold on to memory that the new miner may need
+        old = [miner for miner in self.values() if miner is not new_miner and (miner is active or miner.suspended)]
 
-        if new_miner is not None:
-            new_miner.start()
+        if not any(miner.running for miner in old):
+            # Nothing to wait for
+            begin = monotonic()
+            if new_miner is not None:
+                new_miner.start()
 
-        self.active = new_miner
-        self._impl_onswitch(active, new_miner)
+            self.active = new_miner
+            if active != new_miner:
+                self.app.event(
+                    "switch", stack=self.type, old=active.name if active else None,
+                    new=new_miner.name if new_miner else None, duration=monotonic() - begin,
+                    phases={"start": monotonic() - begin}
+                )
+                self._impl_onswitch(active, new_miner)
+            return
+
+        self.active = None
+        self.handover = Handover(old, new_miner, lambda handover: self._impl_onhandover(active, handover))
+        self.handover.start()
 
     def stop(self):
-        """Stop the active miner."""
+        """Stop the active miner, suspending it if possible."""
+        if self.mode == "shared":
+            for name in self.threads:
+                self._release(self[name], suspend=True)
+            self.threads.clear()
+            self.allocation = {}
+            return
+
         self.switch(None)
 
+    def shutdown(self):
+        """Stop all miners, including suspended ones, wait for them to exit, and close their logs. Blocks for up to
+        `Handover.stop_timeout`, so it is only meant for exiting the application.
+        """
+        if self.handover is not None:
+            self.handover.cancel()
+            self.handover = None
+
+        for miner in self.values():
+            miner.stop()
+
+        deadline = monotonic() + Handover.stop_timeout.total_seconds()
+        for miner in self.values():
+            if miner.running_process is None:
+                continue
+
+            try:
+                miner.running_process.wait(max(0, deadline - monotonic()))
+            except sp.TimeoutExpired:
+                miner.kill()
+
+        self._close_logs(list(self.values()))
+
+        self.active = None
+        self.threads.clear()
+        self.allocation = {}
+
+    def _retire(self):
+        """Stop all miners before the config is reloaded, without waiting for them.
+
+        Miners that are still running are handed over to nothing (see `Handover`), and the stack does not start new
+        miners until they have exited. Their logs are closed afterwards, since the new miners map the same files.
+        """
+        if self.handover is not None:
+            self.handover.cancel()
+            self.handover = None
+
+        old = list(self.values())
+        self.active = None
+        self.threads.clear()
+        self.allocation = {}
+
+        running = [miner for miner in old if miner.running]
+        if not running:
+            self._close_logs(old)
+            return
+
+        def retired(handover):
+            self.handover = None
+            self.app.log(f"Stopped miners of the previous config in {handover.duration:.2f}s")
+            self._close_logs(old)
+            self.app.scheduler.wake()
+
+        self.handover = Handover(running, None, retired)
+        self.handover.start()
+
+    def _close_logs(self, miners: list[Miner]):
+        def close():
+            for miner in miners:
+                miner.log.close()
+
+        # Crash dumps that are still being written read from these logs
+        self.app.crashdumps.after(close)
+
+    def _update_shared(self, context: Context):
+        """Split CPU threads among all eligible miners, and restart miners whose share has changed.
+
+        Threads are released before they are given to other miners: new miners start once the miners that gave up
+        their threads have exited, so the CPU is never oversubscribed.
+        """
+        for name in list(self.threads):
+            miner = self[name]
+            if not miner.running:
+                del self.threads[name]
+                self._crashed(miner)
+
+        eligible = self.eligible(context)
+        allocation = allocate_threads(
+            multiprocessing.cpu_count(),
+            [ThreadDemand(miner.name, miner.thread_share, miner.thread_weight) for miner in eligible]
+        )
+
+        if allocation != self.allocation:
+            self.allocation = allocation
+            self.app.log(
+                "Allocating CPU threads: " +
+                (", ".join(f"{name} {threads}" for name, threads in allocation.items()) or "none")
+            )
+            self.app.event("allocate", stack=self.type, threads=allocation)
+
+        if allocation == self.threads:
+            return
+
+        for name in list(self.threads):
+            if allocation.get(name) != self.threads[name]:
+                # A backend can not change its thread count while running, so it is restarted once it exits
+                self._release(self[name], suspend=name not in allocation)
+                del self.threads[name]
+
+        for miner in self.values():
+            if miner.suspended and allocation.get(miner.name, miner.process_threads) != miner.process_threads:
+                self._release(miner, suspend=False)
+
+        if any(miner.running and not miner.suspended and miner.name not in self.threads for miner in self.values()):
+            return  # Updated again when they exit
+
+        for name, threads in allocation.items():
+            if name not in self.threads:
+                self[name].process_threads = threads
+                self[name].start()
+                self.threads[name] = threads
+
+    def _release(self, miner: Miner, suspend: bool):
+        """Take threads away from a miner by suspending or stopping it. A miner that does not exit in time is killed."""
+        process = miner.running_process
+
+        if suspend:
+            if miner.suspend():
+                return
+        else:
+            miner.stop()
+
+        def kill():
+            if process.returncode is None:
+                process.kill()
+
+        if process is not None:
+            QTimer.singleShot(int(Handover.stop_timeout.total_seconds() * 1000), kill)
+
+    def _crashed(self, miner: Miner):
+        """Record that a miner stopped unexpectedly, and hold it back according to its supervisor."""
+        uptime = miner.supervisor.run_time()
+        delay = miner.supervisor.crashed()
+
+        log_filename = self.app.crashdumps.dump(miner.name, miner.log)
+        self.app.event(
+            "crash", stack=self.type, miner=miner.name, returncode=miner.returncode, uptime=uptime,
+            crashes=miner.supervisor.crashes, retry_in=delay.total_seconds(), dump=log_filename
+        )
+        self.app.log(
+            f"Miner '{miner.name}' stopped unexpectedly, retrying in {delay}.\n"
+            f"Miner log available as '{log_filename}'"
+        )
+
+    def _impl_onhandover(self, old, handover: Handover):
+        self.handover = None
+        self.active = handover.new
+
+        name = handover.new.name if handover.new else None
+        phases = ", ".join(f"{phase} {duration:.2f}s" for phase, duration in handover.timings.items())
+        self.app.log(f"Switched to {name} in {handover.duration:.2f}s ({phases})")
+        self.app.event(
+            "switch", stack=self.type, old=old.name if old else None,
+            new=handover.new.name if handover.new else None, duration=handover.duration, phases=handover.timings
+        )
+
+        self._impl_onswitch(old, handover.new)
+
+        # The stack may have changed its mind while the handover was in progress
+        self.app.scheduler.wake()
+
     def _impl_onswitch(self, old, new):
         if self.onswitch is not None:
             self.onswitch(old, new)
 
+    def _impl_onfinished(self, returncode):
+        self.app.scheduler.wake()
+
     def __getitem__(self, key) -> Miner:
         return self.miners[key]
 
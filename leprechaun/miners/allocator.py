@@ -0,0 +1,43 @@
+from collections import namedtuple
+
+ThreadDemand = namedtuple("ThreadDemand", ["name", "share", "weight"])
+"""Request of one miner for CPU threads. `share` is a fixed fraction of all threads, or None if the miner takes a part
+of the remaining threads according to its `weight`.
+"""
+
+
+def allocate_threads(total: int, demands: list[ThreadDemand]) -> dict[str, int]:
+    """Split `total` threads among miners, in order of priority. Return thread counts of miners that get any threads.
+
+    Miners with a `share` get that fraction of all threads, rounded, but at least one. Remaining threads are split
+    among the other miners proportionally to their `weight`, so that no thread is left unused while there is a weighted
+    miner. When threads run out, miners later in the list get none.
+    """
+    result = {}
+    free = total
+
+    for demand in demands:
+        if demand.share is not None and free > 0:
+            threads = min(max(1, round(demand.share * total)), free)
+            result[demand.name] = threads
+            free -= threads
+
+    # Every weighted miner needs at least one thread, so only as many of them as there are threads can run
+    weighted = [demand for demand in demands if demand.share is None][:free]
+    if not weighted:
+        return result
+
+    # One thread each, and the rest is split by weight. Leftovers of rounding go to the largest remainders
+    extra = free - len(weighted)
+    total_weight = sum(demand.weight for demand in weighted)
+    ideal = [extra * demand.weight / total_weight for demand in weighted]
+    counts = [int(value) for value in ideal]
+
+    by_remainder = sorted(range(len(weighted)), key=lambda i: counts[i] - ideal[i])
+    for i in by_remainder[:extra - sum(counts)]:
+        counts[i] += 1
+
+    for demand, count in zip(weighted, counts):
+        result[demand.name] = 1 + count
+
+    return result
@@ -1,13 +1,24 @@
 from abc import ABC, abstractmethod
-from collections import deque
+from collections import namedtuple
 import platform
 import sys
-from threading import Thread
 import shlex
 import subprocess as sp
+from datetime import datetime, timedelta
+from time import monotonic
+from typing import Optional
 
-from leprechaun.util import InvalidConfigError, popen, Signal
-from leprechaun.conditions import condition
+from leprechaun.util import (
+    free_port, InvalidConfigError, memory_usage, parse_duration, parse_size, popen, Reactor, resume, Signal, suspend
+)
+from leprechaun.conditions import Context, condition
+from .localapi import ApiPoller, ApiStats, LocalApi, samples as api_samples
+from .logring import LogRing
+from .metrics import LineParser, Metrics
+from .supervisor import Supervisor
+
+Backend = namedtuple("Backend", ["name", "url", "sha256", "remove_nested"])
+"""Archive with a miner backend. `name` identifies the backend and its version, like "xmrig-6.14.1"."""
 
 
 class Miner(ABC):
@@ -16,20 +27,51 @@ class Miner(ABC):
     else:
         _proc_flags = 0
 
+    parser = LineParser()
+    """Extracts metrics from backend output. Override in subclasses."""
+
+    reactor = Reactor()
+    """Reads output of all running backends in a single thread."""
+
+    api_type: Optional[type[LocalApi]] = None
+    """Client of the backend's local HTTP API, if it has one. Override in subclasses."""
+
+    poller = ApiPoller()
+    """Fetches stats from APIs of all running backends in a single thread."""
+
+    fee_coef = 1.0
+    """Fraction of the hashrate that is paid out after backend and pool fees. Override in subclasses."""
+
     def __init__(self, name, data, config):
         super().__init__()
         self.name = name
         self.currency = None
         self.address = None
         self.enabled = None
-        self.broken = False
+        self.supervisor = Supervisor()
+        self.backend_dir = None
+        """Directory of the installed backend. Set by `Provisioner`."""
         self.condition = None
         self.extra_backend_args = None
+        self.suspend_timeout = timedelta(minutes=10)
+        """How long a suspended backend is kept before it is stopped. Zero disables suspending."""
+        self.suspend_memory_limit = None
+        """Backends that hold more memory than this (in bytes) are stopped instead of suspended."""
+        self.suspended_at: Optional[datetime] = None
 
         self.running_process = None
-        self.log = deque(maxlen=1000)
+        self.api: Optional[LocalApi] = None
+        """API of the running backend, on a port that is picked anew on every start."""
+        self.log = LogRing(capacity=1 << 20)
+        """Backend output. Replaced with a persistent ring by `MinerStack`."""
+        self.metrics = Metrics()
+        self.history = None
+        """Optional `TimeSeries` where hashrate samples are persisted."""
+        self.calibration = None
+        """Optional `BenchmarkResult` of this miner on this machine. See `leprechaun benchmark`."""
 
         self.logUpdated = Signal(str)
+        """Emitted with a batch of new log lines, joined with newlines."""
         self.processFinished = Signal(int)
 
         # Parsing configuration ----------------------------------------------------------------------------------------
@@ -66,6 +108,11 @@ class Miner(ABC):
         if not isinstance(self.extra_backend_args, list):
             raise InvalidConfigError("field 'extra-backend-args' must be a list or a string")
 
+        if "suspend-timeout" in data:
+            self.suspend_timeout = timedelta(seconds=parse_duration(data, "suspend-timeout"))
+        if "suspend-memory-limit" in data:
+            self.suspend_memory_limit = parse_size(data, "suspend-memory-limit")
+
     # Abstract methods =================================================================================================
     @abstractmethod
     def hashrate(self):
@@ -79,22 +126,96 @@ class Miner(ABC):
     def earnings_pending(self):
         """Pending earnings for this address."""
 
+    @abstractmethod
+    def required_backend(self) -> Backend:
+        """Return the backend that must be installed before this miner can start."""
+
     @abstractmethod
     def args(self):
         """Return a list of command-line arguments required to launch the process, like for subprocess.run.
 
-        Example: return [leprechaun.miners_dir / "ethminer" / "ethminer.exe", "--pool", "..."]
+        Example: return [self.backend_dir / "ethminer.exe", "--pool", "..."]
+        """
+
+    # Tuning ===========================================================================================================
+    @property
+    def needs_tuning(self):
+        """Whether settings of this miner must be found with `tune()` before it can start. Override in subclasses."""
+        return False
+
+    def tune(self, backend_dir, log, busy=lambda: False) -> dict:
+        """Find the best settings for this machine by running the backend in `backend_dir`, and apply them. Return the
+        settings and measurements, for logging. May take minutes, and is called from a background thread.
+
+        `busy` returns whether other miners are working. Measurements taken while they are may be too low, so they
+        should only be used until the next start.
         """
+        return {}
+
+    def skip_tuning(self):
+        """Apply default settings in place of those `tune()` failed to find. Override in subclasses."""
 
     # Properties =======================================================================================================
+    def allowed(self, context: Context = None):
+        """Whether this miner's condition is satisfied. Pass the same context to evaluate several miners at once."""
+        return self.condition is None or self.condition.satisfied(context or Context())
+
+    @property
+    def ready(self):
+        """Whether the backend is installed."""
+        return self.backend_dir is not None
+
     @property
-    def allowed(self):
-        return self.condition is None or self.condition.satisfied()
+    def broken(self):
+        """Whether the miner is held back after a crash. See `Supervisor`."""
+        return self.supervisor.broken()
 
     @property
     def running(self):
+        """Whether the backend process is alive, including while it is suspended."""
         return self.running_process is not None and self.running_process.returncode is None
 
+    @property
+    def suspended(self):
+        return self.suspended_at is not None and self.running
+
+    @property
+    def suspended_until(self) -> Optional[datetime]:
+        """Moment when a suspended backend is stopped for good, or None if it is not suspended."""
+        if not self.suspended:
+            return None
+        return self.suspended_at + self.suspend_timeout
+
+    def expected_hashrate(self) -> Optional[float]:
+        """Hashrate to expect from this miner, adjusted for fees. Measured while the miner is working, otherwise taken
+        from its benchmark, or averaged over the last hour of its previous run. None if none of these are available.
+        """
+        if self.running and not self.suspended:
+            hashrate = self.hashrate()
+            if hashrate is not None:
+                return hashrate
+
+        if self.calibration is not None and self.calibration.hashrate is not None:
+            return self.calibration.hashrate * self.fee_coef
+
+        if self.history is None:
+            return None
+
+        last = self.history.last()
+        if last is None:
+            return None
+
+        _, values = self.history.columns(start=last[0] - 60 * 60)
+        return sum(values) / len(values) * self.fee_coef
+
+    @property
+    def api_stats(self) -> Optional[ApiStats]:
+        """Latest stats from the backend API, or None if the API has not answered recently."""
+        metrics = self.metrics
+        if metrics.api_updated is None or monotonic() - metrics.api_updated > 3 * self.poller.interval:
+            return None
+        return metrics.api
+
     @property
     def returncode(self):
         if self.running_process is None:
@@ -107,32 +228,91 @@ class Miner(ABC):
 
     # Actions ==========================================================================================================
     def start(self):
+        if self.suspended:
+            resume(self.running_process)
+            self.suspended_at = None
+            return
+
         if not self.running:
+            self.metrics = Metrics()
+            self.supervisor.started()
+            self.api = self.api_type(free_port()) if self.api_type is not None else None
             self.running_process = popen(self.args() + self.extra_backend_args,
                 stdin=sp.PIPE,
                 stdout=sp.PIPE,
                 stderr=sp.STDOUT,
-                text=True,
                 creationflags=self._proc_flags
             )
-            Thread(target=self._poll).start()
+            self.reactor.add(self.running_process, self._on_output, self.processFinished.emit)
+            if self.api is not None:
+                self.poller.add(self)
 
     def stop(self):
         if self.running:
             self.running_process.terminate()
+            if self.suspended:
+                # A frozen process does not handle the termination signal until it is thawed
+                resume(self.running_process)
+
+            self.suspended_at = None
+            self.supervisor.stopped()
+
+    def kill(self):
+        """Stop the backend forcefully, for when it does not react to `stop()`."""
+        if self.running:
+            self.running_process.kill()
+            self.suspended_at = None
+
+    def suspend(self) -> bool:
+        """Freeze the backend, so that it can be resumed without the cost of starting again.
+
+        Backends that can not be suspended according to `suspend_timeout` and `suspend_memory_limit` are stopped.
+        Return whether the backend was suspended.
+        """
+        if not self.running or self.suspended:
+            return self.suspended
+
+        if self.suspend_timeout <= timedelta(0):
+            self.stop()
+            return False
+
+        if self.suspend_memory_limit is not None:
+            memory = memory_usage(self.running_process)
+            if memory is None or memory > self.suspend_memory_limit:
+                self.stop()
+                return False
+
+        suspend(self.running_process)
+        self.suspended_at = datetime.now()
+        return True
+
+    def record_api(self, stats: ApiStats):
+        """Record stats fetched from the backend API. Called by `ApiPoller`."""
+        self.metrics.api = stats
+        self.metrics.api_updated = monotonic()
+        self._record(api_samples(stats))
 
     # Internal =========================================================================================================
-    def _poll(self):
-        proc = self.running_process
+    def _on_output(self, lines):
+        self.log.extend(lines)
+
+        # While the API answers, output only counts errors, which the API does not report
+        api_alive = self.api_stats is not None
+
+        for line in lines:
+            samples = self.parser.parse(line)
+            if api_alive:
+                samples = [sample for sample in samples if sample.kind == "error"]
+            self._record(samples)
 
-        for line in iter(proc.stdout.readline, ""):
-            line = line.strip()
-            if line != "":
-                self.log.append(line)
-                self.logUpdated.emit(line)
+        self.logUpdated.emit("\n".join(lines))
 
-        proc.wait()
-        self.processFinished.emit(proc.returncode)
+    def _record(self, samples):
+        self.metrics.record(samples)
+        if self.history is not None:
+            for kind, value in samples:
+                if kind == "hashrate":
+                    self.history.append(value)
 
     # ==================================================================================================================
     def __repr__(self):
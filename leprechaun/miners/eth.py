@@ -1,25 +1,51 @@
-import leprechaun as le
-from leprechaun.util import InvalidConfigError, download_and_extract
+from leprechaun.util import InvalidConfigError
 from leprechaun.api.ethermine import totaldue, totalpaid
-from .base import Miner
+from .base import Backend, Miner
+from .localapi import TrexApi
+from .metrics import LineParser, Sample, re_error, si
 import re
 
 
+def _trex_shares(m):
+    accepted, total = int(m.group(1)), int(m.group(2))
+    return [Sample("accepted", accepted), Sample("rejected", total - accepted)]
+
+
+class TrexParser(LineParser):
+    rules = [
+        (re.compile(r"(\d+\.\d\d) MH/s"), lambda m: [Sample("hashrate", float(m.group(1)) * 10**6)]),
+        (re.compile(r"\[(?: OK |FAIL)\] (\d+)/(\d+)"), _trex_shares),
+        (re.compile(r"diff: (\d+(?:\.\d+)?) ?([KMGT]?)H?\b"), lambda m: [Sample("difficulty", si(*m.groups()))]),
+        (re_error, lambda m: [Sample("error", 1)]),
+    ]
+
+
+def _ethminer_shares(m):
+    return [Sample("accepted", int(m.group(1))), Sample("rejected", int(m.group(2) or 0))]
+
+
+class EthminerParser(LineParser):
+    rules = [
+        (re.compile(r"(\d+\.\d\d) (h|Kh|Mh)\b"), lambda m: [Sample("hashrate", si(*m.groups()))]),
+        (re.compile(r"\d:\d\d A(\d+)(?:\+\d+)?(?::R(\d+))? "), _ethminer_shares),  # After uptime
+        (
+            re.compile(r"difficulty\s*:?\s*(\d+(?:\.\d+)?) ?(h|Kh|Mh|Gh|Th)", re.IGNORECASE),
+            lambda m: [Sample("difficulty", si(*m.groups()))]
+        ),
+        (re_error, lambda m: [Sample("error", 1)]),
+    ]
+
+
 class EthMiner(Miner):
     trex_version = "0.21.6"
     trex_url = \
         f"https://github.com/trexminer/T-Rex/releases/download/{trex_version}/t-rex-{trex_version}-win.zip"
-    trex_dir = le.miners_dir / f"t-rex-{trex_version}"
-    trex_exe = trex_dir / "t-rex.exe"
+    trex_sha256 = None  # SHA-256 of the release archive. Until set, the store pins the first download
 
     nsfminer_version = "1.3.14"
     nsfminer_url = \
         f"https://github.com/no-fee-ethereum-mining/nsfminer/releases/download/v{nsfminer_version}/nsfminer_{nsfminer_version}-windows_10-cuda_11.3-opencl.zip"
-    nsfminer_dir = le.miners_dir / f"nsfminer-{nsfminer_version}"
-    nsfminer_exe = nsfminer_dir / "nsfminer.exe"
-
-    re_trex_hashrate = re.compile(r"(\d+\.\d\d) MH\/s")
-    re_ethminer_hashrate = re.compile(r"(\d+\.\d\d) (h|Kh|Mh)")
+    nsfminer_sha256 = None  # SHA-256 of the release archive. Until set, the store pins the first download
 
     def __init__(self, name, data, config):
         super().__init__(name, data, config)
@@ -28,15 +54,21 @@ class EthMiner(Miner):
         if self.backend not in ("t-rex", "ethminer"):
             raise InvalidConfigError(f"backend must be one of: 't-rex', 'ethminer' (got '{self.backend}')")
 
+        self.parser = TrexParser() if self.backend == "t-rex" else EthminerParser()
+        # nsfminer only has a JSON-RPC API over raw TCP, so its stats come from the output
+        self.api_type = TrexApi if self.backend == "t-rex" else None
+
+    def required_backend(self):
         if self.backend == "t-rex":
-            download_and_extract(self.trex_url, self.trex_dir)
-        else:
-            download_and_extract(self.nsfminer_url, self.nsfminer_dir)
+            return Backend(f"t-rex-{self.trex_version}", self.trex_url, self.trex_sha256, remove_nested=False)
+        return Backend(
+            f"nsfminer-{self.nsfminer_version}", self.nsfminer_url, self.nsfminer_sha256, remove_nested=False
+        )
 
     def args(self):
         if self.backend == "t-rex":
-            return [
-                self.trex_exe,
+            result = [
+                self.backend_dir / "t-rex.exe",
                 "-a", "ethash",
                 "-o", "stratum+tcp://eu1.ethermine.org:4444",
                 "-u", self.address,
@@ -44,37 +76,29 @@ class EthMiner(Miner):
                 "-w", self.workername,
             ]
 
+            if self.api is not None:
+                result += ["--api-bind-http", f"{self.api.host}:{self.api.port}", "--api-read-only"]
+
+            return result
+
         return [
-            self.nsfminer_exe,
+            self.backend_dir / "nsfminer.exe",
             "-P", f"stratum+ssl://{self.address}.{self.workername}:x@eu1.ethermine.org:5555",
             "--nocolor"
         ]
 
+    @property
+    def fee_coef(self):
+        if self.backend == "t-rex":
+            return 0.99 * 0.99  # Miner fee, then pool fee
+        return 0.99  # Pool fee
+
     def hashrate(self):
-        for line in reversed(self.log):
-            if self.backend == "t-rex":
-                m = re.search(self.re_trex_hashrate, line)
-                if not m:
-                    continue
-
-                hashrate = float(m.group(1)) * 10**6
-                return hashrate * 0.99 * 0.99  # Adjust for miner fee, then pool fee
-            else:
-                m = re.search(self.re_ethminer_hashrate, line)
-                if not m:
-                    continue
-
-                if m.group(2) == "h":
-                    power = 0
-                elif m.group(2) == "Kh":
-                    power = 3
-                elif m.group(2) == "Mh":
-                    power = 6
-
-                hashrate = float(m.group(1)) * 10**power
-                return hashrate * 0.99  # Adjust for pool fee
-
-        return None
+        # Both backends report momentary hashrate, so smooth it over the last minute
+        hashrate = self.metrics.hashrate.mean(60)
+        if hashrate is None:
+            return None
+        return hashrate * self.fee_coef
 
     def earnings_total(self):
         return totalpaid(self.address) + totaldue(self.address)
@@ -0,0 +1,119 @@
+from datetime import timedelta
+from time import monotonic
+from typing import Callable, Optional
+
+from PySide6.QtCore import QObject, QTimer
+
+from .base import Miner
+
+
+def _ms(duration: timedelta):
+    return int(duration.total_seconds() * 1000)
+
+
+class Handover(QObject):
+    """Switch from one set of miners to another miner without letting them run at the same time.
+
+    Phases, in order:
+    1. "stop" - old miners are asked to stop, and given `stop_timeout` to exit;
+    2. "kill" - miners that are still running are killed, and given `kill_timeout` to exit;
+    3. "release" - the system is given `release_delay` to free resources of the old miners, like GPU memory;
+    4. "start" - the new miner is started, if there is one.
+
+    Nothing blocks: the handover advances on process exit notifications and timers. Time spent in every phase is
+    recorded in `timings`, and `callback` is called with the handover once it is complete.
+    """
+
+    stop_timeout = timedelta(seconds=10)
+    kill_timeout = timedelta(seconds=5)
+    release_delay = timedelta(milliseconds=500)
+
+    def __init__(self, old: list[Miner], new: Optional[Miner], callback: Callable[["Handover"], None]):
+        super().__init__()
+        self.old = old
+        self.new = new
+        self.callback = callback
+
+        self.phase = None
+        self.timings: dict[str, float] = {}
+        """Seconds spent in every completed phase."""
+        self._phase_began = None
+        self._began = None
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self._timeout)
+
+    @property
+    def duration(self) -> float:
+        """Total seconds from the start of the handover to the end of the last completed phase."""
+        return sum(self.timings.values())
+
+    def start(self):
+        self._began = monotonic()
+        self._enter("stop")
+
+        for miner in self.old:
+            miner.processFinished.connect(self._exited)
+            miner.stop()
+
+        self._wait(self.stop_timeout)
+
+    def cancel(self):
+        """Stop advancing the handover. Miners are left as they are."""
+        self.timer.stop()
+        self._disconnect()
+        self.phase = None
+
+    # Internal =========================================================================================================
+    def _enter(self, phase):
+        now = monotonic()
+        if self.phase is not None:
+            self.timings[self.phase] = now - self._phase_began
+
+        self.phase = phase
+        self._phase_began = now
+
+    def _wait(self, timeout):
+        """Wait for the old miners to exit, but no longer than `timeout`."""
+        if any(miner.running for miner in self.old):
+            self.timer.start(_ms(timeout))
+        else:
+            self._release()
+
+    def _exited(self, returncode):
+        if self.phase in ("stop", "kill") and not any(miner.running for miner in self.old):
+            self.timer.stop()
+            self._release()
+
+    def _timeout(self):
+        if self.phase == "stop":
+            self._enter("kill")
+            for miner in self.old:
+                miner.kill()
+            self._wait(self.kill_timeout)
+        elif self.phase == "kill":
+            # Nothing more can be done about a process that survives being killed
+            self._release()
+        elif self.phase == "release":
+            self._start()
+
+    def _release(self):
+        self._disconnect()
+        self._enter("release")
+        self.timer.start(_ms(self.release_delay))
+
+    def _start(self):
+        self._enter("start")
+        if self.new is not None:
+            self.new.start()
+
+        self._enter(None)
+        self.callback(self)
+
+    def _disconnect(self):
+        for miner in self.old:
+            try:
+                miner.processFinished.disconnect(self._exited)
+            except RuntimeError:
+                pass  # Already disconnected
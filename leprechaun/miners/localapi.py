@@ -0,0 +1,199 @@
+"""Structured stats from the HTTP APIs that miner backends serve on localhost.
+
+APIs are more reliable than backend output, and report per-thread or per-device hashrates, which output does not. When
+an API does not respond, metrics fall back to what is parsed from the output.
+"""
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from threading import Event, Lock, Thread
+from typing import Optional
+
+import requests
+
+from .metrics import Sample
+
+ApiStats = namedtuple("ApiStats", ["hashrate", "windows", "accepted", "rejected", "difficulty", "uptime", "threads"])
+"""Stats reported by a backend API.
+
+`hashrate` is the best available average, in H/s. `windows` maps averaging windows, like "10s" or "15m", to hashrates.
+`threads` is a list of hashrates of every CPU thread or GPU. Values that a backend does not report are None.
+"""
+
+_session = requests.Session()
+_session.trust_env = False  # Proxies from the environment do not apply to localhost
+
+
+class LocalApi(ABC):
+    """Client of one backend's API. Subclasses specify `path` and convert responses to `ApiStats` in `parse`."""
+
+    path = "/"
+    timeout = (0.5, 2)
+    """Connect and read timeouts in seconds. A backend on the same machine answers quickly or not at all."""
+
+    def __init__(self, port, host="127.0.0.1"):
+        self.host = host
+        self.port = port
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}{self.path}"
+
+    def fetch(self) -> ApiStats:
+        response = _session.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        return self.parse(response.json())
+
+    @staticmethod
+    @abstractmethod
+    def parse(data) -> ApiStats:
+        """Convert a decoded JSON response to `ApiStats`. Raise ValueError if the response has an unexpected shape."""
+
+    def __repr__(self):
+        return f"{type(self).__name__}(url='{self.url}')"
+
+
+def _number(value) -> Optional[float]:
+    return float(value) if isinstance(value, (int, float)) else None
+
+
+def _integer(value) -> Optional[int]:
+    return value if isinstance(value, int) else None
+
+
+def _expect(value, type, name):
+    """Return `value` if it is an instance of `type`, and raise ValueError otherwise."""
+    if not isinstance(value, type):
+        raise ValueError(f"unexpected API response: '{name}' is {value!r}")
+    return value
+
+
+class XmrigApi(LocalApi):
+    """xmrig HTTP API, enabled with `--http-host` and `--http-port`."""
+
+    path = "/2/summary"
+
+    @staticmethod
+    def parse(data) -> ApiStats:
+        _expect(data, dict, "response")
+        hashrate = _expect(data.get("hashrate", {}), dict, "hashrate")
+        results = _expect(data.get("results", {}), dict, "results")
+
+        # Windows that are not filled yet are reported as null
+        windows = dict(zip(("10s", "60s", "15m"), map(_number, _expect(hashrate.get("total", []), list, "total"))))
+        best = next((value for value in reversed(windows.values()) if value is not None), None)
+
+        threads = []
+        for thread in _expect(hashrate.get("threads", []), list, "threads"):
+            thread = [_number(value) for value in _expect(thread, list, "threads")]
+            threads.append(next((value for value in reversed(thread) if value is not None), None))
+
+        accepted = _integer(results.get("shares_good"))
+        total = _integer(results.get("shares_total"))
+
+        return ApiStats(
+            hashrate=best,
+            windows=windows,
+            accepted=accepted,
+            rejected=total - accepted if accepted is not None and total is not None else None,
+            difficulty=_number(results.get("diff_current")),
+            uptime=_number(data.get("uptime")),
+            threads=threads,
+        )
+
+
+class TrexApi(LocalApi):
+    """T-Rex HTTP API, enabled with `--api-bind-http`."""
+
+    path = "/summary"
+
+    @staticmethod
+    def parse(data) -> ApiStats:
+        _expect(data, dict, "response")
+        windows = {
+            window: _number(data[key])
+            for window, key in (("now", "hashrate"), ("1m", "hashrate_minute"), ("1h", "hashrate_hour"))
+            if key in data
+        }
+
+        # A miner that has just started reports 0, which is a real value
+        hashrate = windows.get("1m")
+        if hashrate is None:
+            hashrate = windows.get("now")
+
+        gpus = _expect(data.get("gpus", []), list, "gpus")
+
+        return ApiStats(
+            hashrate=hashrate,
+            windows=windows,
+            accepted=_integer(data.get("accepted_count")),
+            rejected=_integer(data.get("rejected_count")),
+            difficulty=None,  # Reported as a formatted string, like "4.29 G", which output parsing handles already
+            uptime=_number(data.get("uptime")),
+            threads=[_number(_expect(gpu, dict, "gpus").get("hashrate")) for gpu in gpus],
+        )
+
+
+def samples(stats: ApiStats) -> list[Sample]:
+    """Convert API stats to the same samples that are parsed from backend output."""
+    result = []
+    for kind in ("hashrate", "accepted", "rejected", "difficulty"):
+        value = getattr(stats, kind)
+        if value is not None:
+            result.append(Sample(kind, value))
+
+    return result
+
+
+class ApiPoller:
+    """A thread that fetches stats of every registered miner once per `interval` seconds.
+
+    Miners are dropped once their process exits. Suspended miners are skipped, since a frozen process can not answer.
+    Stats are delivered with `Miner.record_api`, from the poller thread.
+    """
+
+    def __init__(self, interval=10):
+        self.interval = interval
+
+        self._miners = []
+        self._lock = Lock()
+        self._wake = Event()
+        self._thread = None
+
+    def add(self, miner):
+        with self._lock:
+            if miner not in self._miners:
+                self._miners.append(miner)
+
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name="api-poller", daemon=True)
+                self._thread.start()
+
+    def poll(self):
+        """Fetch stats right away instead of waiting for the rest of the interval."""
+        self._wake.set()
+
+    # Internal =========================================================================================================
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+            with self._lock:
+                self._miners = [miner for miner in self._miners if miner.running and miner.api is not None]
+                miners = list(self._miners)
+
+            for miner in miners:
+                if miner.suspended:
+                    continue
+
+                api = miner.api
+                try:
+                    stats = api.fetch()
+                except (OSError, ValueError):
+                    # Not listening yet, or exiting. Errors of requests derive from OSError, bad JSON and unexpected
+                    # responses raise ValueError
+                    continue
+
+                # The process may have been restarted with a new API while the request was in flight
+                if miner.api is api:
+                    miner.record_api(stats)
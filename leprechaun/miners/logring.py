@@ -0,0 +1,247 @@
+import gzip
+import mmap
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import islice
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Iterable, Iterator
+
+
+class LogRing:
+    """Miner output in a fixed-size ring of bytes, mapped into memory.
+
+    Lines are stored as UTF-8 and separated by newlines. When the ring is full, new lines overwrite the oldest ones, so
+    memory use does not depend on how much output a miner produces. If `path` is specified, the ring is stored in that
+    file and survives restarts. Otherwise, it is stored in anonymous memory.
+
+    A closed ring reads as empty and ignores new lines, since output may still arrive from other threads.
+    """
+
+    header = struct.Struct("<8sQQ")
+    """File header: magic, capacity, and `head` - total amount of bytes ever written."""
+    magic = b"LEPRLOG1"
+
+    def __init__(self, path=None, capacity=50 << 20):
+        self.path = Path(path) if path is not None else None
+        self.capacity = capacity
+        self.closed = False
+        self._lock = Lock()
+
+        size = self.header.size + capacity
+
+        if self.path is None:
+            self._file = None
+            self._map = mmap.mmap(-1, size)
+            self._write_header(0)
+            return
+
+        self._file = open(self.path, "a+b")
+        self._file.seek(0)
+        header = self._file.read(self.header.size)
+
+        if len(header) != self.header.size or self.header.unpack(header)[:2] != (self.magic, capacity):
+            # New file, or a file written with a different capacity
+            self._file.truncate(0)
+
+        self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._write_header(self.head)
+
+    @property
+    def head(self):
+        """Total amount of bytes ever written. Stored in the mapping, so that rings sharing a file agree on it."""
+        return self.header.unpack_from(self._map)[2]
+
+    def position(self) -> int:
+        """Return `head`, or 0 if the ring is closed."""
+        with self._lock:
+            return 0 if self.closed else self.head
+
+    @property
+    def start(self):
+        """Offset of the oldest byte still stored, in the same units as `head`."""
+        return max(0, self.head - self.capacity)
+
+    def append(self, line: str):
+        self.extend([line])
+
+    def extend(self, lines: Iterable[str]):
+        data = "".join(line + "\n" for line in lines).encode("utf-8")
+
+        with self._lock:
+            if self.closed:
+                return
+
+            head = self.head
+            if len(data) > self.capacity:
+                head += len(data) - self.capacity
+                data = data[-self.capacity:]
+
+            position = head % self.capacity
+            first = min(len(data), self.capacity - position)
+            offset = self.header.size
+
+            self._map[offset + position:offset + position + first] = data[:first]
+            self._map[offset:offset + len(data) - first] = data[first:]
+
+            self._write_header(head + len(data))
+
+    def snapshot(self, end=None) -> bytes:
+        """Return all complete lines currently stored, as one newline-separated block of UTF-8.
+
+        If `end` is specified, only lines written before `head` reached `end` are returned.
+        """
+        with self._lock:
+            if self.closed:
+                return b""
+
+            start = self.start
+            end = self.head if end is None else min(end, self.head)
+            if end <= start:
+                return b""
+            data = self._read(start, end)
+
+        if start > 0:
+            # The oldest line is partially overwritten
+            data = data[data.find(b"\n") + 1:]
+
+        return data
+
+    def tail(self, count) -> list[str]:
+        """Return up to `count` newest lines, oldest first."""
+        lines = list(islice(reversed(self), count))
+        lines.reverse()
+        return lines
+
+    def close(self):
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+
+            self._map.close()
+            if self._file is not None:
+                self._file.close()
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over lines, oldest first. Makes a copy of the whole ring."""
+        for line in self.snapshot().split(b"\n"):
+            if line:
+                yield line.decode("utf-8", "replace")
+
+    def __reversed__(self) -> Iterator[str]:
+        """Iterate over lines, newest first, reading the ring back in small chunks."""
+        chunk_size = 1 << 16
+
+        with self._lock:
+            if self.closed:
+                return
+            end = self.head
+
+        rest = b""
+        while True:
+            with self._lock:
+                if self.closed:
+                    return
+
+                # The ring may have moved on since the last chunk, overwriting lines that were not yet read
+                start = self.start
+                if end <= start:
+                    break
+
+                begin = max(start, end - chunk_size)
+                data = self._read(begin, end) + rest
+
+            end = begin
+            rest, *lines = data.split(b"\n")
+
+            for line in reversed(lines):
+                if line:
+                    yield line.decode("utf-8", "replace")
+
+        # Unless the ring has wrapped around, the first line is complete
+        if end == 0 and rest:
+            yield rest.decode("utf-8", "replace")
+
+    # Internal =========================================================================================================
+    def _read(self, begin, end) -> bytes:
+        """Read bytes between two offsets. Must be called with the lock held."""
+        position = begin % self.capacity
+        length = end - begin
+        offset = self.header.size
+
+        if position + length <= self.capacity:
+            return self._map[offset + position:offset + position + length]
+
+        first = self.capacity - position
+        return self._map[offset + position:offset + self.capacity] + self._map[offset:offset + length - first]
+
+    def _write_header(self, head):
+        self.header.pack_into(self._map, 0, self.magic, self.capacity, head)
+
+
+class CrashDumps:
+    """Folder with compressed logs of miners that stopped unexpectedly.
+
+    Dumps are compressed and written in the background. Only the newest `max_count` dumps are kept, and only for
+    `max_age`.
+    """
+
+    def __init__(self, dir, max_count=50, max_age=timedelta(days=30)):
+        self.dir = Path(dir)
+        self.max_count = max_count
+        self.max_age = max_age
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="crashdump")
+
+    def dump(self, name, log: LogRing) -> str:
+        """Save a copy of a miner log. Return the name of the file it will be written to.
+
+        The log is copied in the background as well, up to the point it reached when this was called, so that output of
+        a restarted miner does not get into the dump.
+        """
+        filename = f"[{datetime.now().isoformat(' ', 'milliseconds').replace(':', '.')}] {name}.txt.gz"
+        end = log.position()
+
+        self.executor.submit(self._write, self.dir / filename, log, end)
+        return filename
+
+    def prune(self):
+        """Delete dumps beyond `max_count` or older than `max_age`."""
+        dumps = []
+        for path in self.dir.iterdir():
+            try:
+                dumps.append((path.stat().st_mtime, path))
+            except OSError:
+                pass  # Deleted concurrently
+
+        dumps.sort(reverse=True)
+        since = time() - self.max_age.total_seconds()
+
+        for i, (mtime, path) in enumerate(dumps):
+            if i >= self.max_count or mtime < since:
+                path.unlink(missing_ok=True)
+
+    def after(self, fn):
+        """Call `fn` in the background once dumps that were started so far are written, for example to close their
+        logs. There is only one worker, so jobs run in order.
+        """
+        self.executor.submit(fn)
+
+    def shutdown(self):
+        """Finish writing dumps in progress."""
+        self.executor.shutdown(wait=True)
+
+    def _write(self, path, log: LogRing, end):
+        data = log.snapshot(end)
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+        temp_path = path.with_name(path.name + ".tmp")
+        with gzip.open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+        self.prune()
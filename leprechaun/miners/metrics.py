@@ -0,0 +1,136 @@
+import re
+from array import array
+from collections import namedtuple
+from threading import Lock
+from time import time
+from typing import Callable, Iterable, Optional
+
+Sample = namedtuple("Sample", ["kind", "value"])
+"""A single value extracted from miner output. `kind` is one of: hashrate, accepted, rejected, difficulty, error."""
+
+
+class RingBuffer:
+    """Fixed-size buffer of numbers, stored in a typed array. When full, new values overwrite the oldest ones."""
+
+    def __init__(self, size, typecode="d"):
+        self.size = size
+        self.data = array(typecode, bytes(size * array(typecode).itemsize))
+        self.count = 0
+        """Total amount of values ever appended."""
+
+    def append(self, value):
+        self.data[self.count % self.size] = value
+        self.count += 1
+
+    def last(self):
+        if self.count == 0:
+            return None
+        return self.data[(self.count - 1) % self.size]
+
+    def __getitem__(self, index):
+        """Get a value by index, where 0 is the oldest value still stored and -1 is the newest."""
+        length = len(self)
+        if not -length <= index < length:
+            raise IndexError("ring buffer index out of range")
+
+        return self.data[(self.count - length + index % length) % self.size]
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+
+class Series:
+    """Timestamped samples of one metric, stored in two parallel ring buffers."""
+
+    def __init__(self, size=256):
+        self.times = RingBuffer(size)
+        self.values = RingBuffer(size)
+        self._lock = Lock()
+
+    def append(self, value, timestamp=None):
+        with self._lock:
+            self.times.append(time() if timestamp is None else timestamp)
+            self.values.append(value)
+
+    def last(self) -> Optional[float]:
+        return self.values.last()
+
+    def mean(self, window) -> Optional[float]:
+        """Average of all samples taken in the last `window` seconds, or the latest sample if there are none."""
+        with self._lock:
+            since = time() - window
+            total = 0
+            count = 0
+
+            for i in range(len(self.values) - 1, -1, -1):
+                if self.times[i] < since:
+                    break
+                total += self.values[i]
+                count += 1
+
+            if count == 0:
+                return self.values.last()
+            return total / count
+
+    def __len__(self):
+        return len(self.values)
+
+
+class Metrics:
+    """Numeric metrics of a running miner, updated as output lines and API stats arrive."""
+
+    def __init__(self):
+        self.hashrate = Series()
+        self.difficulty = Series(size=16)
+        self.accepted = 0
+        self.rejected = 0
+        self.errors = 0
+
+        self.api = None
+        """Latest `ApiStats` from the backend API, if it has one."""
+        self.api_updated = None
+        """Moment when `api` was fetched, from `time.monotonic`."""
+
+    def record(self, samples: Iterable[Sample]):
+        for kind, value in samples:
+            if kind == "hashrate":
+                self.hashrate.append(value)
+            elif kind == "difficulty":
+                self.difficulty.append(value)
+            elif kind == "accepted":
+                self.accepted = int(value)
+            elif kind == "rejected":
+                self.rejected = int(value)
+            elif kind == "error":
+                self.errors += 1
+
+
+class LineParser:
+    """Extract samples from lines of miner output.
+
+    Subclasses fill `rules` with pairs of a regular expression and a function, which converts a match into samples.
+    Parsing is stateless, so the same parser can be used to classify old log lines.
+    """
+
+    rules: list[tuple[re.Pattern, Callable[[re.Match], Iterable[Sample]]]] = []
+
+    def parse(self, line: str) -> list[Sample]:
+        result = []
+
+        for regex, convert in self.rules:
+            m = regex.search(line)
+            if m:
+                result.extend(convert(m))
+
+        return result
+
+
+si_prefixes = {"": 1, "k": 10**3, "m": 10**6, "g": 10**9, "t": 10**12}
+
+
+def si(value, unit):
+    """Convert a value with a unit such as "h", "Kh", "MH" or "G" into a plain number."""
+    return float(value) * si_prefixes.get(unit[:1].lower(), 1)
+
+
+re_error = re.compile(r"\berror\b", re.IGNORECASE)
@@ -0,0 +1,165 @@
+from datetime import datetime, timedelta
+from typing import Optional
+
+from leprechaun.api import minerstat
+from .base import Miner
+
+
+class ProfitPolicy:
+    """Pick the eligible miner with the highest expected revenue per hour.
+
+    Revenue is the miner's expected hashrate (see `Miner.expected_hashrate`) times the reward and price of its currency
+    from minerstat. Restarting a miner costs hashrate, so the active miner is only replaced if another one earns at
+    least `margin` more, and not before it has worked for `min_dwell`. Miners with unknown revenue are ranked after the
+    rest in stack order, and without any prices the first eligible miner is picked.
+
+    Prices are fetched in the background every `refresh_interval`. Choosing a miner never waits for the network.
+    """
+
+    refresh_interval = timedelta(minutes=5)
+
+    def __init__(self, app, margin=0.05, min_dwell=timedelta(minutes=15)):
+        self.app = app
+        self.margin = margin
+        self.min_dwell = min_dwell
+
+        self.prices: dict[str, tuple[float, float]] = {}
+        """Price in USD and reward in coins per 1 H/s per hour, by currency."""
+        self._refresh_due: Optional[datetime] = None
+        """Moment when prices should be fetched again."""
+        self._refresh = None
+
+        self._chosen: Optional[Miner] = None
+        self._chosen_at: Optional[datetime] = None
+        self._decision = None
+        """Last logged decision, so that a decision that did not change is not logged again."""
+
+    def revenue(self, miner: Miner) -> Optional[float]:
+        """Expected revenue of a miner in USD per hour, or None if it is not known yet."""
+        if miner.currency not in self.prices:
+            return None
+
+        hashrate = miner.expected_hashrate()
+        if hashrate is None:
+            return None
+
+        price, reward = self.prices[miner.currency]
+        return hashrate * reward * price
+
+    def choose(self, candidates: list[Miner], active: Optional[Miner], now: datetime) -> Optional[Miner]:
+        """Return the miner that should work, out of eligible `candidates` in stack order."""
+        self.refresh({miner.currency for miner in candidates})
+
+        if not candidates:
+            self._decision = None
+            return self._remember(None, now)
+
+        revenues = {miner.name: self.revenue(miner) for miner in candidates}
+        known = [miner for miner in candidates if revenues[miner.name] is not None]
+        if not known:
+            self._decision = None
+            return self._remember(candidates[0], now)
+
+        best = max(known, key=lambda miner: revenues[miner.name])
+
+        if active is None or active not in candidates:
+            self._log("switch", best, active, revenues)
+            return self._remember(best, now)
+
+        if best is active:
+            self._decision = None
+            return self._remember(active, now)
+
+        if self._chosen is active and now - self._chosen_at < self.min_dwell:
+            self._log("dwell", best, active, revenues)
+            return self._remember(active, now)
+
+        if revenues[active.name] is not None and revenues[best.name] < revenues[active.name] * (1 + self.margin):
+            self._log("margin", best, active, revenues)
+            return self._remember(active, now)
+
+        self._log("switch", best, active, revenues)
+        return self._remember(best, now)
+
+    def next_change(self) -> Optional[datetime]:
+        """Return the moment when the choice may change because of new prices or an expiring dwell time."""
+        now = datetime.now()
+        deadlines = []
+
+        # While prices are being fetched, the scheduler is woken when they arrive. A refresh that is already due waits
+        # for the next choice, since without currencies to price it does not start at all
+        if self._refresh is None and self._refresh_due is not None and self._refresh_due > now:
+            deadlines.append(self._refresh_due)
+
+        if self._decision is not None and self._decision[0] == "dwell":
+            dwell_end = self._chosen_at + self.min_dwell
+            if dwell_end > now:
+                deadlines.append(dwell_end)
+
+        return min(deadlines, default=None)
+
+    def refresh(self, currencies):
+        """Start fetching prices in the background, if they are missing or outdated."""
+        if not currencies or self._refresh is not None:
+            return
+        if self._refresh_due is not None and datetime.now() < self._refresh_due:
+            return
+
+        self._refresh = self.app.executor_api.submit(minerstat.stats, currencies)
+        self._refresh.add_done_callback(self._refreshed)
+
+    # Internal =========================================================================================================
+    def _refreshed(self, future):
+        self._refresh = None
+        self._refresh_due = datetime.now() + self.refresh_interval
+
+        try:
+            info = future.result()
+            self.prices = {
+                coin["coin"]: (coin["price"], coin["reward"]) for coin in info if coin["reward_unit"] == coin["coin"]
+            }
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            # Network errors, or a response in an unexpected shape. Old prices are kept until the next refresh
+            self.app.event("api-error", endpoint="minerstat", error=repr(e))
+        finally:
+            # Either way, the scheduler has to pick up the new refresh deadline
+            self.app.scheduler.wake()
+
+    def _remember(self, miner, now):
+        if miner is not self._chosen:
+            self._chosen = miner
+            self._chosen_at = now
+        return miner
+
+    def _log(self, decision, best, active, revenues):
+        key = (decision, best.name, active.name if active else None)
+        if key == self._decision:
+            return
+        self._decision = key
+
+        def describe(miner):
+            revenue = revenues.get(miner.name)
+            hashrate = miner.expected_hashrate()
+            if revenue is None:
+                return f"'{miner.name}' (unknown)"
+            return f"'{miner.name}' ({hashrate:.1f} H/s, ${revenue * 24:.4f}/day)"
+
+        if decision == "switch":
+            message = f"Most profitable miner is {describe(best)}"
+            if active is not None:
+                message += f", replacing {describe(active)}"
+        elif decision == "dwell":
+            message = (
+                f"Keeping {describe(active)} for at least {self.min_dwell} after it started, although "
+                f"{describe(best)} is more profitable"
+            )
+        else:
+            message = (
+                f"Keeping {describe(active)}, since {describe(best)} is less than {self.margin:.0%} more profitable"
+            )
+
+        self.app.log(message)
+        self.app.event(
+            "profit", decision=decision, best=best.name, active=active.name if active else None,
+            revenues={name: revenue for name, revenue in revenues.items() if revenue is not None}
+        )
@@ -0,0 +1,146 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from time import monotonic
+from typing import Optional
+
+from .base import Backend, Miner
+from .store import BackendStore
+
+
+class Provisioner:
+    """Installs miner backends in the background, several at a time.
+
+    Miners whose backends are already installed become ready right away. Others become ready as soon as their backend
+    is installed, at which point the application is woken up to reconsider its miner stacks.
+    """
+
+    def __init__(self, app, store: BackendStore, max_workers=3):
+        self.app = app
+        self.store = store
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="provision")
+        self.executor_tune = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tune")
+        """Tuning runs benchmarks, which would disturb each other if several ran at once."""
+
+        self.jobs: dict[str, Future] = {}
+        self.progress: dict[str, float] = {}
+        """Progress of every installation in progress, from 0 to 1."""
+
+        self._lock = Lock()
+
+    def provision(self, miner: Miner):
+        """Mark a miner as ready, or start installing its backend if it is missing."""
+        backend = miner.required_backend()
+
+        with self._lock:
+            job = self.jobs.get(backend.name)
+
+            if job is None:
+                path = self.store.lookup(backend)
+                if path is not None:
+                    self._ready(miner, path)
+                    return
+
+                self.app.log(f"Downloading backend '{backend.name}'")
+                self.progress[backend.name] = 0
+                job = self.jobs[backend.name] = self.executor.submit(self._install, backend)
+
+        job.add_done_callback(lambda future: self._finished(miner, backend, future))
+
+    def total_progress(self) -> Optional[float]:
+        """Return combined progress of all installations in progress, or None if there are none."""
+        with self._lock:
+            if not self.progress:
+                return None
+            return sum(self.progress.values()) / len(self.progress)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor_tune.shutdown(wait=False, cancel_futures=True)
+
+    def _install(self, backend: Backend):
+        begin = monotonic()
+        reported = 0
+
+        def callback(progress):
+            nonlocal reported
+            with self._lock:
+                self.progress[backend.name] = progress
+
+            # Wake the app every 10% to refresh its status, but not on every chunk
+            if progress - reported >= 0.1:
+                reported = progress
+                self.app.scheduler.wake()
+
+        path = self.store.install(backend, callback)
+        self.app.event("backend-installed", backend=backend.name, duration=monotonic() - begin)
+        return path
+
+    def collect(self, miners):
+        """Delete installed backends that none of `miners` use."""
+        with self._lock:
+            keep = {miner.required_backend().name for miner in miners} | set(self.jobs)
+
+        self.store.collect(keep)
+
+    def _finished(self, miner: Miner, backend: Backend, future: Future):
+        with self._lock:
+            # Several miners may wait for the same job, but only the first one cleans up
+            if self.jobs.get(backend.name) is future:
+                del self.jobs[backend.name]
+                self.progress.pop(backend.name, None)
+                first = True
+            else:
+                first = False
+
+        if future.cancelled():
+            return
+
+        error = future.exception()
+        if error is not None:
+            if first:
+                self.app.log(f"Could not download backend '{backend.name}':", error)
+                self.app.event("backend-failed", backend=backend.name, error=repr(error))
+            return
+
+        if first:
+            self.app.log(f"Backend '{backend.name}' is ready")
+
+        self._ready(miner, future.result())
+
+    def _ready(self, miner: Miner, path):
+        """Mark a miner as ready once its backend is installed, tuning it first if needed."""
+        if not miner.needs_tuning:
+            miner.backend_dir = path
+            self.app.scheduler.wake()
+            return
+
+        self.app.log(f"Tuning miner '{miner.name}', this may take a few minutes")
+        future = self.executor_tune.submit(self._tune, miner, path)
+        future.add_done_callback(lambda future: self._tuned(miner, path, future))
+
+    def _tune(self, miner: Miner, path):
+        begin = monotonic()
+        settings = miner.tune(path, self.app.log, busy=lambda: self._busy(miner))
+        self.app.event("tuned", miner=miner.name, duration=monotonic() - begin, **settings)
+
+    def _tuned(self, miner: Miner, path, future: Future):
+        if future.cancelled():
+            return
+
+        error = future.exception()
+        if error is not None:
+            self.app.log(f"Could not tune miner '{miner.name}', using default settings:", error)
+            self.app.event("tune-failed", miner=miner.name, error=repr(error))
+            miner.skip_tuning()
+
+        miner.backend_dir = path
+        self.app.scheduler.wake()
+
+    def _busy(self, miner: Miner):
+        """Whether miners other than `miner` are working, and so would slow down its benchmarks."""
+        for stack in (self.app.cpuminers, self.app.gpuminers):
+            for other in list(stack.miners.values()):
+                if other is not miner and other.running and not other.suspended:
+                    return True
+
+        return False
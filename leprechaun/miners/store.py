@@ -0,0 +1,194 @@
+import json
+import os
+import shutil
+from pathlib import Path
+from tempfile import mkdtemp
+from threading import Lock
+from typing import Iterable, Optional
+from urllib.parse import urlparse
+
+from leprechaun.util import download, extract, file_sha256
+from .base import Backend
+
+
+class BackendStore:
+    """Content-addressed storage of installed miner backends.
+
+    Layout inside the root directory:
+    - `store/<hash>/` - unpacked archive with SHA-256 `<hash>`, including a `.manifest.json` with its files;
+    - `refs.json` - mapping of backend names (like "xmrig-6.14.1") to archive hashes;
+    - `staging/` - backends being unpacked, which are renamed into `store/` once complete;
+    - `downloads/<name>/` - archives being downloaded, kept across restarts so that an interrupted download resumes.
+
+    Installation is atomic: a backend is either fully present in `store/` or not at all. Backend versions that are
+    built from an identical archive share one directory.
+    """
+
+    manifest_name = ".manifest.json"
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.store_dir = self.root / "store"
+        self.staging_dir = self.root / "staging"
+        self.downloads_dir = self.root / "downloads"
+        self.refs_path = self.root / "refs.json"
+
+        self._lock = Lock()
+
+        # Anything in staging was left by an interrupted installation
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+    def lookup(self, backend: Backend) -> Optional[Path]:
+        """Return the directory of an installed backend, or None if it is missing or damaged."""
+        digest = backend.sha256 or self._refs().get(backend.name)
+        if digest is None:
+            return None
+
+        path = self._path(digest)
+        if not self.verify(path):
+            return None
+
+        if backend.sha256 is not None:
+            # The same archive may be installed under a different name
+            with self._lock:
+                self._set_ref(backend.name, digest)
+
+        return path
+
+    def install(self, backend: Backend, callback=None) -> Path:
+        """Download and unpack a backend, reusing an identical archive if it is already installed. Return its directory.
+
+        The archive is downloaded in parallel segments that are retried after network errors and resumed after a
+        restart, and checked against `backend.sha256`. Without one, it is checked against the archive this backend name
+        was first installed from, so that a reinstallation can not silently pick up a replaced release.
+        """
+        for path in (self.staging_dir, self.store_dir):
+            path.mkdir(parents=True, exist_ok=True)
+
+        if callback is not None:
+            cb1 = lambda progress: callback(progress * 0.9)
+            cb2 = lambda progress: callback(0.9 + progress * 0.1)
+        else:
+            cb1 = None
+            cb2 = None
+
+        sha256 = backend.sha256 or self._refs().get(backend.name)
+
+        download_dir = self.downloads_dir / backend.name
+        download_dir.mkdir(parents=True, exist_ok=True)
+        archive = download_dir / urlparse(backend.url).path.rsplit("/", 1)[-1]
+
+        if not archive.exists():
+            download(backend.url, archive, cb1, sha256=sha256)
+        digest = file_sha256(archive)
+        if sha256 is not None and digest != sha256.lower():
+            # Damaged since it was downloaded, or left by a version that did not pin this backend
+            shutil.rmtree(download_dir, ignore_errors=True)
+            raise ValueError(f"checksum mismatch for '{backend.url}': expected {sha256}, got {digest}")
+
+        path = self._path(digest)
+
+        staging = Path(mkdtemp(dir=self.staging_dir)) / "backend"
+        try:
+            with self._lock:
+                if self.verify(path):
+                    self._set_ref(backend.name, digest)
+                    return path
+
+            extract(archive, staging, cb2, remove_nested=backend.remove_nested)
+            self._write_manifest(staging, digest)
+
+            with self._lock:
+                shutil.rmtree(path, ignore_errors=True)  # Damaged installation
+                os.replace(staging, path)
+                self._set_ref(backend.name, digest)
+
+            return path
+        finally:
+            # Only partial downloads are worth keeping, a complete archive that failed to unpack is downloaded again
+            shutil.rmtree(staging.parent, ignore_errors=True)
+            shutil.rmtree(download_dir, ignore_errors=True)
+
+    def verify(self, path) -> bool:
+        """Check that an installed backend matches its manifest.
+
+        Files with unchanged size and modification time are trusted, others are hashed.
+        """
+        path = Path(path)
+
+        try:
+            manifest = json.loads((path / self.manifest_name).read_text())
+        except (OSError, ValueError):
+            return False
+
+        for name, (size, mtime_ns, digest) in manifest["files"].items():
+            try:
+                stat = (path / name).stat()
+            except OSError:
+                return False
+
+            if stat.st_size != size:
+                return False
+            if stat.st_mtime_ns != mtime_ns and file_sha256(path / name) != digest:
+                return False
+
+        return True
+
+    def collect(self, keep: Iterable[str]):
+        """Delete all backends whose names are not in `keep`, and everything else not used by the store."""
+        keep = set(keep)
+
+        if not self.root.exists():
+            return
+
+        with self._lock:
+            refs = {name: digest for name, digest in self._refs().items() if name in keep}
+            self._write_refs(refs)
+
+            used = {self._path(digest).name for digest in refs.values()}
+            if self.store_dir.exists():
+                for path in self.store_dir.iterdir():
+                    if path.name not in used:
+                        shutil.rmtree(path, ignore_errors=True)
+
+            # Partial downloads of backends that are no longer used
+            if self.downloads_dir.exists():
+                for path in self.downloads_dir.iterdir():
+                    if path.name not in keep:
+                        shutil.rmtree(path, ignore_errors=True)
+
+            # Backends installed by older versions of Leprechaun, unpacked directly into the root
+            for path in self.root.iterdir():
+                if path.is_dir() and path not in (self.store_dir, self.staging_dir, self.downloads_dir):
+                    shutil.rmtree(path, ignore_errors=True)
+
+    def _path(self, digest):
+        return self.store_dir / digest[:16]
+
+    def _write_manifest(self, path, digest):
+        files = {}
+        for file in sorted(path.rglob("*")):
+            if file.is_file():
+                stat = file.stat()
+                files[file.relative_to(path).as_posix()] = [stat.st_size, stat.st_mtime_ns, file_sha256(file)]
+
+        (path / self.manifest_name).write_text(json.dumps({"archive": digest, "files": files}, indent=2))
+
+    def _refs(self) -> dict[str, str]:
+        try:
+            return json.loads(self.refs_path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _set_ref(self, name, digest):
+        """Point a backend name to an archive hash. Must be called with the lock held."""
+        refs = self._refs()
+        if refs.get(name) != digest:
+            refs[name] = digest
+            self._write_refs(refs)
+
+    def _write_refs(self, refs):
+        self.root.mkdir(parents=True, exist_ok=True)
+        temp_path = self.refs_path.with_suffix(".tmp")
+        temp_path.write_text(json.dumps(refs, indent=2))
+        os.replace(temp_path, self.refs_path)
@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+from time import monotonic
+from typing import Optional
+
+
+class Supervisor:
+    """Restart policy and crash statistics of a single miner.
+
+    After a crash, the miner is held back for `initial_delay`. Every consecutive crash doubles the delay, up to
+    `max_delay`. A run that lasts at least `stable_after` resets the delay.
+    """
+
+    initial_delay = timedelta(seconds=10)
+    max_delay = timedelta(hours=1)
+    stable_after = timedelta(minutes=5)
+
+    def __init__(self):
+        self.starts = 0
+        self.restarts = 0
+        """How many times the miner was started again after a crash."""
+        self.crashes = 0
+        self.consecutive_crashes = 0
+        self.last_crash: Optional[datetime] = None
+        self.retry_at: Optional[datetime] = None
+        """Moment when a crashed miner may start again, or None if it is not held back."""
+
+        self.uptime = 0.0
+        """Total time the miner has been running for, in seconds, not counting the current run."""
+        self._started_at = None
+        self._crashed = False
+
+    def broken(self, now: datetime = None) -> bool:
+        """Whether the miner is held back after a crash."""
+        return self.retry_at is not None and (now or datetime.now()) < self.retry_at
+
+    def run_time(self) -> float:
+        """Duration of the current or last run in seconds."""
+        if self._started_at is None:
+            return 0.0
+        return monotonic() - self._started_at
+
+    def started(self):
+        self.starts += 1
+        if self._crashed:
+            self.restarts += 1
+            self._crashed = False
+
+        self._started_at = monotonic()
+
+    def stopped(self):
+        """Record that the miner was stopped on purpose."""
+        self.uptime += self.run_time()
+        self._started_at = None
+
+    def crashed(self) -> timedelta:
+        """Record that the miner stopped unexpectedly. Return how long it is held back for."""
+        run_time = self.run_time()
+        self.uptime += run_time
+        self._started_at = None
+
+        if run_time >= self.stable_after.total_seconds():
+            self.consecutive_crashes = 0
+
+        self._crashed = True
+        self.crashes += 1
+        self.consecutive_crashes += 1
+        self.last_crash = datetime.now()
+
+        delay = min(self.initial_delay * 2 ** (self.consecutive_crashes - 1), self.max_delay)
+        self.retry_at = self.last_crash + delay
+        return delay
+
+    def stats(self) -> dict:
+        return {
+            "starts": self.starts,
+            "restarts": self.restarts,
+            "crashes": self.crashes,
+            "consecutive_crashes": self.consecutive_crashes,
+            "last_crash": self.last_crash,
+            "retry_at": self.retry_at,
+            "uptime": self.uptime + (self.run_time() if self._started_at is not None else 0),
+        }
@@ -0,0 +1,45 @@
+import json
+import os
+import platform
+from datetime import datetime
+from multiprocessing import cpu_count
+from pathlib import Path
+from threading import Lock
+from typing import Optional
+
+
+class TuningCache:
+    """Settings that were found to work best for miner backends, stored in a JSON file.
+
+    Entries are keyed by host, thread count and backend, so that the cache stays valid when the data folder is shared
+    between machines, or when the hardware or backend version changes.
+    """
+
+    _lock = Lock()
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def get(self, backend_name) -> Optional[dict]:
+        return self._read().get(self._key(backend_name))
+
+    def set(self, backend_name, settings: dict):
+        with self._lock:
+            data = self._read()
+            data[self._key(backend_name)] = {**settings, "time": datetime.now().isoformat(timespec="seconds")}
+
+            temp_path = self.path.with_name(self.path.name + ".tmp")
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2)
+            os.replace(temp_path, self.path)
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}  # A missing or unreadable file is as good as none, and is replaced on the next save
+
+    @staticmethod
+    def _key(backend_name):
+        return f"{platform.node()}/{cpu_count()}/{backend_name}"
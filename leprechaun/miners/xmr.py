@@ -1,27 +1,53 @@
 import multiprocessing
 import re
+import subprocess as sp
 
 import leprechaun as le
-from leprechaun.util import InvalidConfigError, calc, download_and_extract
+from leprechaun.util import InvalidConfigError, calc, popen
 from leprechaun.api.supportxmr import totaldue, totalpaid
-from .base import Miner
+from .base import Backend, Miner
+from .localapi import XmrigApi
+from .metrics import LineParser, Sample, re_error
+from .tuning import TuningCache
+
+
+def _xmrig_hashrate(m):
+    # Prefer the longest averaging window that is already available
+    for value in reversed(m.groups()):
+        if value != "n/a":
+            return [Sample("hashrate", float(value))]
+    return []
+
+
+def _xmrig_shares(m):
+    return [
+        Sample("accepted", int(m.group(1))),
+        Sample("rejected", int(m.group(2))),
+        Sample("difficulty", int(m.group(3))),
+    ]
+
+
+class XmrigParser(LineParser):
+    rules = [
+        (re.compile(r"miner +speed 10s/60s/15m (\d+\.\d|n/a) (\d+\.\d|n/a) (\d+\.\d|n/a) H/s"), _xmrig_hashrate),
+        (re.compile(r"net +(?:accepted|rejected) \((\d+)/(\d+)\) diff (\d+)"), _xmrig_shares),
+        (re_error, lambda m: [Sample("error", 1)]),
+    ]
 
 
 class XmrMiner(Miner):
     miner_version = "6.14.1"
     miner_url = \
         f"https://github.com/xmrig/xmrig/releases/download/v{miner_version}/xmrig-{miner_version}-msvc-win64.zip"
-    miner_dir = le.miners_dir / f"xmrig-{miner_version}"
-    miner_exe = miner_dir / "xmrig.exe"
+    miner_sha256 = None  # SHA-256 of the release archive. Until set, the store pins the first download
 
-    re_hashrate = \
-        re.compile(r"\[\d\d\d\d-\d\d-\d\d \d\d:\d\d:\d\d\.\d\d\d\]  miner    speed 10s\/60s\/15m (\d+.\d|n\/a) (\d+.\d|n\/a) (\d+.\d|n\/a) H\/s")
+    parser = XmrigParser()
+    api_type = XmrigApi
+    fee_coef = 0.99 * 0.994  # Miner fee, then pool fee
 
     def __init__(self, name, data, config):
         super().__init__(name, data, config)
 
-        download_and_extract(self.miner_url, self.miner_dir, remove_nested=True)
-
         # Configuration ------------------------------------------------------------------------------------------------
         # Process priority
         try:
@@ -38,23 +64,102 @@ class XmrMiner(Miner):
 
         # Process threads
         max_threads = multiprocessing.cpu_count()
+        self.auto_threads = data.get("process-threads") == "auto"
+        """Whether the thread count is found by `tune()`. Until then, `process_threads` is None."""
+
+        if self.auto_threads:
+            tuned = TuningCache(le.data_dir / "tuning.json").get(self.required_backend().name)
+            self.process_threads = tuned["threads"] if tuned is not None else None
+        else:
+            try:
+                process_threads = calc(data.get("process-threads", "max"), {"min": 1, "max": max_threads})
+                if process_threads != int(process_threads):
+                    raise InvalidConfigError(f"process thread count must an integer (got '{process_threads}')")
+
+                self.process_threads = int(process_threads)
+            except ValueError:
+                raise InvalidConfigError("invalid expression in field 'process-threads'") from None
+
+            if not 1 <= self.process_threads <= max_threads:
+                raise InvalidConfigError(
+                    f"process thread count must be in range [1, {max_threads}] (got '{self.process_threads}')"
+                )
+
+        # Thread share and weight, used instead of the thread count when the stack shares the CPU between miners
         try:
-            process_threads = calc(data.get("process-threads", "max"), {"min": 1, "max": max_threads})
-            if process_threads != int(process_threads):
-                raise InvalidConfigError(f"process thread count must an integer (got '{process_threads}')")
+            self.thread_share = calc(data["thread-share"]) if "thread-share" in data else None
+        except ValueError:
+            raise InvalidConfigError("invalid expression in field 'thread-share'") from None
+
+        if self.thread_share is not None and not 0 < self.thread_share <= 1:
+            raise InvalidConfigError(f"thread share must be in range (0, 1] (got '{self.thread_share}')")
 
-            self.process_threads = int(process_threads)
+        try:
+            self.thread_weight = calc(data.get("thread-weight", 1))
         except ValueError:
-            raise InvalidConfigError("invalid expression in field 'process-threads'") from None
+            raise InvalidConfigError("invalid expression in field 'thread-weight'") from None
+
+        if not self.thread_weight > 0:
+            raise InvalidConfigError(f"thread weight must be positive (got '{self.thread_weight}')")
 
-        if not 1 <= self.process_threads <= max_threads:
-            raise InvalidConfigError(
-                f"process thread count must be in range [1, {max_threads}] (got '{self.process_threads}')"
-            )
+    def required_backend(self):
+        return Backend(f"xmrig-{self.miner_version}", self.miner_url, self.miner_sha256, remove_nested=True)
+
+    @property
+    def needs_tuning(self):
+        return self.auto_threads and self.process_threads is None
+
+    def tune(self, backend_dir, log, busy=lambda: False):
+        """Benchmark xmrig with several thread counts, and pick the fastest one.
+
+        RandomX needs 2 MB of L3 cache per thread, so the best thread count is often well below the amount of CPU
+        threads. The result is cached per host and backend version, so other miners with the same backend reuse it.
+        """
+        cache = TuningCache(le.data_dir / "tuning.json")
+        backend_name = self.required_backend().name
+
+        # Another miner may have tuned the same backend while this one was waiting
+        tuned = cache.get(backend_name)
+        if tuned is not None:
+            self.process_threads = tuned["threads"]
+            return tuned
+
+        max_threads = multiprocessing.cpu_count()
+        fractions = (1, 3/4, 1/2, 3/8, 1/4)
+        candidates = sorted({max(1, round(max_threads * fraction)) for fraction in fractions}, reverse=True)
+
+        hashrates = {}
+        contended = False
+        for threads in candidates:
+            contended = contended or busy()
+            hashrates[threads] = self._bench(backend_dir, threads)
+            contended = contended or busy()
+            log(f"Miner '{self.name}' with {threads} threads: " + (
+                f"{hashrates[threads]:.1f} H/s" if hashrates[threads] is not None else "benchmark failed"
+            ))
+
+        measured = {threads: hashrate for threads, hashrate in hashrates.items() if hashrate is not None}
+        if not measured:
+            # Not cached, so that tuning is attempted again on the next start
+            log(f"Could not tune miner '{self.name}', using all {max_threads} threads")
+            self.process_threads = max_threads
+            return {"threads": max_threads, "hashrates": hashrates}
+
+        self.process_threads = max(measured, key=measured.get)
+        settings = {"threads": self.process_threads, "hashrates": hashrates}
+        if contended:
+            # Other miners took CPU time from the benchmark, so it is repeated on the next start
+            log(f"Other miners were working while miner '{self.name}' was tuned, the result is not saved")
+        else:
+            cache.set(backend_name, settings)
+        return {**settings, "contended": contended}
+
+    def skip_tuning(self):
+        self.process_threads = multiprocessing.cpu_count()
 
     def args(self):
-        return [
-            self.miner_exe,
+        result = [
+            self.backend_dir / "xmrig.exe",
             "-o", "pool.supportxmr.com:443",
             "-u", self.address,
             "--rig-id", self.workername,
@@ -63,23 +168,47 @@ class XmrMiner(Miner):
             "-k", "--tls", "--no-color"
         ]
 
-    def hashrate(self):
-        fee_coef = 0.99 * 0.994  # Adjust for miner fee, then pool fee
-
-        for line in reversed(self.log):
-            m = re.match(self.re_hashrate, line)
+        if self.api is not None:
+            result += ["--http-host", self.api.host, "--http-port", str(self.api.port)]
 
-            if not m:
-                continue
+        return result
 
-            if m.group(3) != "n/a":
-                return float(m.group(3)) * fee_coef
-            if m.group(2) != "n/a":
-                return float(m.group(2)) * fee_coef
-            if m.group(1) != "n/a":
-                return float(m.group(1)) * fee_coef
+    def hashrate(self):
+        # xmrig reports hashrate already averaged over up to 15 minutes
+        hashrate = self.metrics.hashrate.last()
+        if hashrate is None:
+            return None
+        return hashrate * self.fee_coef
+
+    bench_hashes = 250_000
+    """Size of the offline benchmark used for tuning. This is the smallest one xmrig offers."""
+
+    def _bench(self, backend_dir, threads):
+        """Run xmrig's offline benchmark and return its hashrate, or None if it failed."""
+        proc = popen([
+                backend_dir / "xmrig.exe",
+                f"--bench={self.bench_hashes // 1000}K",
+                "--cpu-priority", str(self.process_priority),
+                "-t", str(threads),
+                "--no-color"
+            ],
+            stdout=sp.PIPE,
+            stderr=sp.STDOUT,
+            text=True,
+            creationflags=self._proc_flags
+        )
 
-        return None
+        try:
+            output, _ = proc.communicate(timeout=30 * 60)
+        except sp.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+            return None
+
+        m = re.search(r"benchmark finished in (\d+(?:\.\d+)?) seconds", output)
+        if m is None or float(m.group(1)) <= 0:
+            return None
+        return self.bench_hashes / float(m.group(1))
 
     def earnings_total(self):
         return totalpaid(self.address) + totaldue(self.address)
@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta
+from math import ceil
+from typing import Callable, Optional
+
+from PySide6.QtCore import QObject, Qt, QTimer, Signal as QtSignal
+
+
+class Scheduler(QObject):
+    """Call a function once the earliest scheduled deadline is reached, or as soon as an external event arrives.
+
+    Unlike a heartbeat timer, a scheduler sleeps for exactly as long as nothing can change. `wake()` can be called from
+    any thread, for example from a thread that noticed that a miner process has exited.
+    """
+
+    max_interval = timedelta(minutes=1)
+    """Longest time to sleep between calls, which protects against system clock changes and sleep/hibernation."""
+
+    _wakeRequested = QtSignal()
+
+    def __init__(self, callback: Callable):
+        super().__init__()
+        self.callback = callback
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.fire)
+
+        self._wakeRequested.connect(self.fire, Qt.QueuedConnection)
+
+    def schedule(self, deadline: Optional[datetime]):
+        """Call the function at `deadline`. If `deadline` is None, wait for an external event (or `max_interval`)."""
+        if deadline is None:
+            interval = self.max_interval
+        else:
+            interval = min(deadline - datetime.now(), self.max_interval)
+
+        self.timer.start(max(0, ceil(interval.total_seconds() * 1000)))
+
+    def wake(self):
+        """Call the function as soon as possible. Thread-safe."""
+        self._wakeRequested.emit()
+
+    def fire(self):
+        self.timer.stop()
+        self.callback()
+
+    def stop(self):
+        """Cancel the scheduled call. External events can still wake the scheduler."""
+        self.timer.stop()
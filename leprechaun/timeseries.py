@@ -0,0 +1,197 @@
+import csv
+import mmap
+import os
+import re
+import struct
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Optional
+
+
+class TimeSeries:
+    """Append-only on-disk series of (timestamp, value) records with automatic downsampling.
+
+    Data is kept in tiers: raw samples, 1-minute averages and 1-hour averages. Each tier is a file of fixed-width
+    records, which is memory-mapped for reading. When records in a tier get older than its retention period, they are
+    averaged into the next tier.
+    """
+
+    record = struct.Struct("<dd")  # timestamp in seconds since epoch, value
+
+    tiers = [
+        # name, resolution in seconds, retention in seconds
+        ("raw", 0, 2 * 24 * 60 * 60),
+        ("1min", 60, 60 * 24 * 60 * 60),
+        ("1h", 60 * 60, None),
+    ]
+
+    compact_interval = 60 * 60
+    """How often old records are downsampled while appending, in seconds."""
+
+    def __init__(self, path):
+        """Create or open a series. `path` is a path prefix, to which tier names and extensions are added."""
+        self.path = Path(path)
+        self._lock = Lock()
+        self._compacted_at = 0
+
+    def append(self, value, timestamp=None):
+        timestamp = time() if timestamp is None else timestamp
+
+        with self._lock:
+            with open(self._tier_path("raw"), "ab") as f:
+                f.write(self.record.pack(timestamp, value))
+
+        if timestamp - self._compacted_at > self.compact_interval:
+            self.compact(timestamp)
+
+    def columns(self, start=None, end=None) -> tuple[array, array]:
+        """Return timestamps and values of all records in range [start, end) as two arrays, oldest first.
+
+        Older records come from downsampled tiers.
+        """
+        timestamps = array("d")
+        values = array("d")
+
+        with self._lock:
+            for name, _, _ in reversed(self.tiers):
+                with self._map(name) as data:
+                    t = _Timestamps(data)
+                    first = 0 if start is None else bisect_left(t, start)
+                    last = len(t) if end is None else bisect_left(t, end)
+
+                    chunk = array("d", data[first * 2:last * 2])
+
+                timestamps.extend(chunk[0::2])
+                values.extend(chunk[1::2])
+
+        return timestamps, values
+
+    def query(self, start=None, end=None) -> list[tuple[float, float]]:
+        """Return records in range [start, end) as a list of (timestamp, value) pairs, oldest first."""
+        return list(zip(*self.columns(start, end)))
+
+    def last(self) -> Optional[tuple[float, float]]:
+        """Return the latest record, or None if the series is empty."""
+        with self._lock:
+            for name, _, _ in self.tiers:
+                with self._map(name) as data:
+                    if len(data) > 0:
+                        return data[-2], data[-1]
+
+        return None
+
+    def export_csv(self, path, start=None, end=None):
+        """Write records in range [start, end) into a CSV file with columns `time` and `value`."""
+        timestamps, values = self.columns(start, end)
+
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["time", "value"])
+
+            for timestamp, value in zip(timestamps, values):
+                writer.writerow([datetime.fromtimestamp(timestamp).isoformat(" ", "seconds"), value])
+
+    def compact(self, now=None):
+        """Downsample records that are older than their tier's retention period into the next tier."""
+        now = time() if now is None else now
+        self._compacted_at = now
+
+        with self._lock:
+            for (name, _, retention), (next_name, resolution, _) in zip(self.tiers, self.tiers[1:]):
+                # Align the cutoff to the next tier, so that its buckets are never split between two compactions
+                cutoff = (now - retention) // resolution * resolution
+
+                with self._map(name) as data:
+                    split = bisect_left(_Timestamps(data), cutoff)
+                    if split == 0:
+                        continue
+
+                    old = data[:split * 2].tolist()
+                    rest = data[split * 2:].tobytes()
+
+                buckets = {}
+                for timestamp, value in zip(old[0::2], old[1::2]):
+                    bucket = buckets.setdefault(timestamp // resolution * resolution, [0, 0])
+                    bucket[0] += value
+                    bucket[1] += 1
+
+                with open(self._tier_path(next_name), "ab") as f:
+                    for timestamp, (total, count) in sorted(buckets.items()):
+                        f.write(self.record.pack(timestamp, total / count))
+
+                temp_path = self._tier_path(name).with_suffix(".tmp")
+                with open(temp_path, "wb") as f:
+                    f.write(rest)
+                os.replace(temp_path, self._tier_path(name))
+
+    def _tier_path(self, name):
+        return self.path.with_name(f"{self.path.name}.{name}.bin")
+
+    @contextmanager
+    def _map(self, name):
+        """Memory-map a tier file as a flat sequence of doubles (timestamp, value, timestamp, value, ...).
+
+        Slices of the view must not outlive the `with` block, otherwise the mapping cannot be closed.
+        """
+        try:
+            f = open(self._tier_path(name), "rb")
+        except FileNotFoundError:
+            yield memoryview(b"").cast("d")
+            return
+
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            size -= size % self.record.size  # Ignore a record that was torn by a crash
+
+            if size == 0:
+                yield memoryview(b"").cast("d")
+                return
+
+            with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as m:
+                view = memoryview(m).cast("d")
+                try:
+                    yield view
+                finally:
+                    view.release()
+
+
+class _Timestamps:
+    """Timestamps of a mapped tier as a sequence, for binary search without creating slices of the mapping."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def __getitem__(self, index):
+        return self.data[index * 2]
+
+    def __len__(self):
+        return len(self.data) // 2
+
+
+class TimeSeriesStore:
+    """A directory of named time series, for example hashrate per miner or earnings per currency."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._series = {}
+        self._lock = Lock()
+
+    def series(self, *key) -> TimeSeries:
+        """Return a series identified by one or more strings, such as `store.series("hashrate", "cpu", "my-miner")`."""
+        name = "-".join(re.sub(r"[^\w-]", "_", str(part)) for part in key)
+
+        with self._lock:
+            if name not in self._series:
+                self.path.mkdir(parents=True, exist_ok=True)
+                self._series[name] = TimeSeries(self.path / name)
+
+            return self._series[name]
+
+    def names(self) -> list[str]:
+        """Names of all series on disk."""
+        return sorted({path.name.split(".", 1)[0] for path in self.path.glob("*.bin")})
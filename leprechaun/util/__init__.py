@@ -10,6 +10,7 @@ from calc import default_identifiers
 __all__ = [
     # Exceptions
     "InvalidConfigError",
+    "ConfigWarning",
     "format_exception",
 
     # File handling
@@ -17,9 +18,23 @@ __all__ = [
     "download",
     "extract",
     "download_and_extract",
+    "file_sha256",
+
+    # Config values
+    "parse_duration",
+    "parse_size",
 
     # Suprocess management
     "popen",
+    "suspend",
+    "resume",
+    "memory_usage",
+    "peak_memory_usage",
+    "cpu_time",
+    "Reactor",
+
+    # Networking
+    "free_port",
 
     # Qt Signals
     "Signal",
@@ -30,10 +45,13 @@ __all__ = [
     "calc"
 ]
 
-from .exceptions import InvalidConfigError, format_exception
+from .exceptions import ConfigWarning, InvalidConfigError, format_exception
 from .files import (ClosedNamedTemporaryFile, download, download_and_extract,
-                    extract)
-from .subprocess import popen
+                    extract, file_sha256)
+from .subprocess import cpu_time, memory_usage, peak_memory_usage, popen, resume, suspend
+from .units import parse_duration, parse_size
+from .reactor import Reactor
+from .net import free_port
 from .signal import Signal
 
 # Misc utilities =======================================================================================================
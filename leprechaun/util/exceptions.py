@@ -5,6 +5,10 @@ class InvalidConfigError(ValueError):
     pass
 
 
+class ConfigWarning(UserWarning):
+    """A config value that is accepted, but not as written."""
+
+
 _exception_formatter = ExceptionFormatter(colored=False, max_length=None)
 def format_exception(exc, value, tb):
     return list(_exception_formatter.format_exception(exc, value, tb))
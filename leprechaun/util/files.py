@@ -1,9 +1,15 @@
+import hashlib
+import json
 import os
 import shutil
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from pathlib import Path
-from tarfile import TarFile
-from tempfile import NamedTemporaryFile, TemporaryDirectory
+from pathlib import Path, PurePosixPath
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
+from threading import Lock
+from time import sleep
+from typing import Optional
 from urllib.parse import urlparse
 from zipfile import ZipFile
 
@@ -19,122 +25,346 @@ def ClosedNamedTemporaryFile(*, suffix=None, prefix=None, dir=None, errors=None)
     finally:
         os.unlink(tf.name)
 
-def download_and_extract(url, dest, callback=None, *, format=None, if_exists=False, remove_nested=False):
-    """Download a zip or tar archive and unpack it into a specified folder.
+def download_and_extract(
+    url, dest, callback=None, *, format=None, if_exists=False, remove_nested=False, sha256=None,
+    spool_size=64 << 20, timeout=(10, 60)
+):
+    """Download a zip or tar archive and unpack it into a specified folder. Return the SHA-256 hex digest of the
+    archive.
     If `if_exists` is True, download and extract even if the path already exists.
     If `nested` is True, assume the archive contains a single folder with files inside (not files directly).
+    If `sha256` is specified, the archive is verified against this hex digest, and `dest` is removed on a mismatch.
+
+    The archive is never saved to disk. Tar archives are unpacked straight from the network stream. Zip archives need
+    random access, so they are downloaded into a buffer that stays in memory up to `spool_size` bytes.
     """
     dest = Path(dest)
 
     if not if_exists and dest.exists():
-        return
+        return None
+
+    format = format or _archive_format(urlparse(url).path)
+    created = not dest.exists()
+
+    if callback is not None and format == "zip":
+        cb1 = lambda progress: callback(progress / 2)
+        cb2 = lambda progress: callback(0.5 + progress / 2)
+    else:
+        cb1 = callback
+        cb2 = None
+
+    try:
+        with _session.get(url, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            length = response.headers.get("content-length")
+            length = int(length) if length is not None else None
+
+            reader = _Reader(response.raw, length, cb1)
+
+            if format == "zip":
+                with SpooledTemporaryFile(max_size=spool_size) as buffer:
+                    shutil.copyfileobj(reader, buffer, 1 << 20)
+                    buffer.seek(0)
+                    with ZipFile(buffer) as zf:
+                        _unpack_zip(zf, dest, cb2, remove_nested=remove_nested)
+            else:
+                with tarfile.open(fileobj=reader, mode="r|*") as tf:
+                    _unpack_tar(tf, dest, remove_nested=remove_nested)
+                reader.drain()  # Padding after the end of the archive is still part of its checksum
+
+        digest = reader.digest.hexdigest()
+        if sha256 is not None and digest != sha256.lower():
+            raise ValueError(f"checksum mismatch for '{url}': expected {sha256}, got {digest}")
+    except BaseException:
+        if created:
+            shutil.rmtree(dest, ignore_errors=True)
+        raise
+
+    return digest
+
+_session = requests.Session()
+
+def download(url, filename, callback=None, *, sha256=None, segments=4, chunk_size=1 << 20, retries=3, timeout=(10, 60)):
+    """Download a file from `url` into `filename`.
+
+    The file is downloaded into `<filename>.part` first, and renamed once complete and verified against `sha256` (if
+    specified). If the server supports range requests, the file is split into `segments` parts that are downloaded in
+    parallel. Progress of every part is saved into `<filename>.part.json`, so that an interrupted download is resumed
+    instead of restarted. Every part is retried up to `retries` times after a network error.
+    """
+    filename = Path(filename)
+    part_path = filename.with_name(filename.name + ".part")
+    state_path = filename.with_name(filename.name + ".part.json")
+
+    # Probe the server -------------------------------------------------------------------------------------------------
+    try:
+        head = _session.head(url, allow_redirects=True, timeout=timeout)
+        head.raise_for_status()
+    except requests.HTTPError:
+        # Some servers do not allow HEAD requests
+        length = None
+        ranges = False
+    else:
+        url = head.url  # Skip redirects from now on
+        length = head.headers.get("content-length")
+        length = int(length) if length is not None else None
+        ranges = head.headers.get("accept-ranges", "none").lower() == "bytes"
+
+    if length is None or not ranges:
+        _download_stream(url, part_path, callback, chunk_size=chunk_size, retries=retries, timeout=timeout)
+    else:
+        _download_segments(
+            url, part_path, state_path, length, callback,
+            segments=segments, chunk_size=chunk_size, retries=retries, timeout=timeout
+        )
+
+    # Verify and finish ------------------------------------------------------------------------------------------------
+    if sha256 is not None:
+        digest = file_sha256(part_path)
+        if digest != sha256.lower():
+            part_path.unlink()
+            state_path.unlink(missing_ok=True)
+            raise ValueError(f"checksum mismatch for '{url}': expected {sha256}, got {digest}")
+
+    os.replace(part_path, filename)
+    state_path.unlink(missing_ok=True)
+
+def _download_stream(url, part_path, callback, *, chunk_size, retries, timeout):
+    """Download a file in one piece, for servers that do not support range requests. A failed attempt starts over."""
+    for attempt in range(retries + 1):
+        try:
+            with _session.get(url, stream=True, timeout=timeout) as response:
+                response.raise_for_status()
+                length = response.headers.get("content-length")
+                length = int(length) if length is not None else None
+
+                completed = 0
+                with open(part_path, "wb") as f:
+                    for data in response.iter_content(chunk_size=chunk_size):
+                        completed += len(data)
+                        f.write(data)
 
-    supposed_filename = urlparse(url).path.rsplit("/", 1)[-1]  # Last component of path
-    supposed_suffix = "".join(Path(supposed_filename).suffixes)
+                        if callback is not None and length:
+                            callback(completed / length)
 
-    with ClosedNamedTemporaryFile(suffix=supposed_suffix) as tempfile:
+            if length is not None and completed < length:
+                raise OSError(f"download of '{url}' ended prematurely")
+            return
+        except OSError:
+            if attempt == retries:
+                raise
+            sleep(2 ** attempt)
+
+def _download_segments(url, part_path, state_path, length, callback, *, segments, chunk_size, retries, timeout):
+    """Download a file in parallel segments using range requests, resuming from `state_path` if possible."""
+    # Each segment is a list [start, end, completed], where end is exclusive
+    state = None
+    if part_path.exists() and state_path.exists():
+        try:
+            state = json.loads(state_path.read_text())
+        except ValueError:
+            pass
+
+        if state is None or state.get("length") != length or part_path.stat().st_size != length:
+            state = None
+
+    lock = Lock()
+
+    def save_state():
+        temp_path = state_path.with_suffix(".tmp")
+        temp_path.write_text(json.dumps(state))
+        os.replace(temp_path, state_path)
+
+    if state is None:
+        count = max(1, min(segments, length // chunk_size))
+        bounds = [length * i // count for i in range(count + 1)]
+        state = {"length": length, "segments": [[start, end, 0] for start, end in zip(bounds, bounds[1:])]}
+
+        with open(part_path, "wb") as f:
+            f.truncate(length)
+        save_state()
+
+    def report():
         if callback is not None:
-            cb1 = lambda progress: callback(progress / 2)
-            cb2 = lambda progress: callback(0.5 + progress / 2)
-        else:
-            cb1 = None
-            cb2 = None
+            callback(sum(segment[2] for segment in state["segments"]) / length)
 
-        download(url, tempfile, cb1)
-        extract(tempfile, dest, cb2, format=format, remove_nested=remove_nested)
+    def fetch(segment):
+        start, end, _ = segment
 
-def download(url, filename, callback=None):
-    response = requests.get(url, stream=True)
+        for attempt in range(retries + 1):
+            if start + segment[2] >= end:
+                return
 
-    with open(filename, "wb") as f:
-        length = response.headers.get('content-length')
+            try:
+                headers = {"Range": f"bytes={start + segment[2]}-{end - 1}"}
+                with _session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        raise OSError(f"server ignored range request for '{url}'")
 
-        if length is None: # no content length header
-            f.write(response.content)
-        else:
-            completed = 0
-            length = int(length)
-            for data in response.iter_content(chunk_size=4096):
-                completed += len(data)
-                f.write(data)
+                    with open(part_path, "r+b") as f:
+                        f.seek(start + segment[2])
+                        for data in response.iter_content(chunk_size=chunk_size):
+                            data = data[:end - start - segment[2]]
+                            f.write(data)
+
+                            with lock:
+                                segment[2] += len(data)
+                                save_state()
+                                report()
+            except OSError:
+                if attempt == retries:
+                    raise
+                sleep(2 ** attempt)
+
+        if start + segment[2] < end:
+            raise OSError(f"download of '{url}' ended prematurely")
+
+    with ThreadPoolExecutor(max_workers=len(state["segments"]), thread_name_prefix="download") as executor:
+        for future in [executor.submit(fetch, segment) for segment in state["segments"]]:
+            future.result()
 
-                if callback is not None:
-                    callback(completed / length)
+def file_sha256(path, chunk_size=1 << 20):
+    """Return the SHA-256 hex digest of a file."""
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        while data := f.read(chunk_size):
+            digest.update(data)
+
+    return digest.hexdigest()
 
 _formats = {name: extensions for name, extensions, _ in shutil.get_unpack_formats()}
 
+def _archive_format(filename):
+    """Determine archive format from a file name, as one of the format names used by `shutil`."""
+    for format, extensions in _formats.items():
+        for extension in extensions:
+            if filename.endswith(extension):
+                return format
+
+    raise ValueError(f"Could not determine archive format from filename '{filename.rsplit('/', 1)[-1]}'")
+
 def extract(src, dest, callback=None, *, format=None, if_exists=False, remove_nested=False):
-    """Download a zip or tar archive and extract it into a specified folder.
-    If `if_exists` is True, download and extract even if the path already exists.
+    """Extract a zip or tar archive into a specified folder.
+    If `if_exists` is True, extract even if the path already exists.
     If `nested` is True, assume the archive contains a single folder with files inside (not files directly).
     """
     src = Path(src)
+    dest = Path(dest)
 
     if not if_exists and dest.exists():
         return
 
-    # Determine format -------------------------------------------------------------------------------------------------
-    suffix = "".join(src.suffixes)
-    format = None
-
-    for format_check, extensions in _formats.items():
-        for extension in extensions:
-            if suffix.endswith(extension):
-                format = format_check
-                break
+    format = format or _archive_format(src.name)
 
-        if format is not None:
-            break
+    if format == "zip":
+        with ZipFile(src) as zf:
+            _unpack_zip(zf, dest, callback, remove_nested=remove_nested)
+    elif format in ("tar", "gztar", "bztar", "xztar"):
+        with open(src, "rb") as f:
+            reader = _Reader(f, src.stat().st_size, callback)
+            with tarfile.open(fileobj=reader, mode="r|*") as tf:
+                _unpack_tar(tf, dest, remove_nested=remove_nested)
+    else:
+        raise ValueError(f"Unknown archive format '{format}'")
 
-    if format is None:
-        raise ValueError(f"Could not determine archive format from filename '{src.name}'")
+class _Reader:
+    """Wrapper of a binary stream that hashes all data read from it and reports progress in bytes."""
 
-    # Extract functions ------------------------------------------------------------------------------------------------
-    def extract_tar(dest):
-        with TarFile(src) as tf:
-            members = tf.getmembers()
-            length = len(members)
-            completed = 0
+    def __init__(self, f, length=None, callback=None):
+        self.f = f
+        self.length = length
+        self.callback = callback
+        self.completed = 0
+        self.digest = hashlib.sha256()
 
-            for member in members:
-                tf.extract(member, dest)
-                completed += 1
+    def read(self, size=-1):
+        data = self.f.read(size if size >= 0 else None)
+        self.completed += len(data)
+        self.digest.update(data)
 
-                if callback is not None:
-                    callback(completed / length)
+        if self.callback is not None and self.length:
+            self.callback(min(self.completed / self.length, 1))
 
-    def extract_zip(dest):
-        with ZipFile(src) as zf:
-            members = zf.infolist()
-            length = len(members)
-            completed = 0
+        return data
 
-            for member in members:
-                zf.extract(member, dest)
-                completed += 1
+    def drain(self, chunk_size=1 << 20):
+        """Read the stream to the end."""
+        while self.read(chunk_size):
+            pass
 
-                if callback is not None:
-                    callback(completed / length)
+class _Destination:
+    """Maps archive member names to paths inside `dest`, stripping the nested folder if required."""
 
-    if format in ("tar", "gztar", "bztar", "xztar"):
-        extract = extract_tar
-    elif format == "zip":
-        extract = extract_zip
-    else:
-        raise ValueError(f"Unknown archive format '{format}'")
+    def __init__(self, dest, remove_nested):
+        self.dest = dest
+        self.remove_nested = remove_nested
+        self.prefix = None
 
-    # Extract file -----------------------------------------------------------------------------------------------------
-    if remove_nested:
-        # Handle nested directory
-        with TemporaryDirectory() as tempdir:
-            tempdir = Path(tempdir)
-            extract(tempdir)
-            files = list(tempdir.glob("*"))
+    def __call__(self, name, is_dir) -> Optional[Path]:
+        """Return the path of a member, or None if the member is the nested folder itself."""
+        parts = PurePosixPath(name).parts
 
-            if len(files) != 1:
+        if self.remove_nested and parts:
+            if self.prefix is None:
+                self.prefix = parts[0]
+            if parts[0] != self.prefix or (len(parts) == 1 and not is_dir):
                 raise ValueError("remove_nested set to True, but more than one file found")
+            parts = parts[1:]
 
-            file = files[0]
-            shutil.copytree(file, dest)
-    else:
-        extract(dest)
+        if not parts:
+            return None
+        if parts[0] == "/" or ".." in parts:
+            raise ValueError(f"Archive member '{name}' points outside of the destination")
+
+        return self.dest.joinpath(*parts)
+
+def _write_member(source, path, mode):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        shutil.copyfileobj(source, f, 1 << 20)
+
+    if mode & 0o111:
+        os.chmod(path, path.stat().st_mode | 0o111)
+
+def _unpack_tar(tf, dest, *, remove_nested=False):
+    """Unpack an open tar archive in a single pass, so that it may be read from a stream."""
+    destination = _Destination(dest, remove_nested)
+    dest.mkdir(parents=True, exist_ok=True)
+
+    for member in tf:
+        path = destination(member.name, member.isdir())
+        if path is None:
+            continue
+
+        if member.isdir():
+            path.mkdir(parents=True, exist_ok=True)
+        elif member.isfile():
+            _write_member(tf.extractfile(member), path, member.mode)
+        # Links and special files are not used by miner archives, and are skipped
+
+def _unpack_zip(zf, dest, callback=None, *, remove_nested=False):
+    """Unpack an open zip archive, reporting progress by uncompressed bytes."""
+    destination = _Destination(dest, remove_nested)
+    dest.mkdir(parents=True, exist_ok=True)
+
+    members = zf.infolist()
+    length = sum(member.file_size for member in members)
+    completed = 0
+
+    for member in members:
+        path = destination(member.filename, member.is_dir())
+        if path is None:
+            continue
+
+        if member.is_dir():
+            path.mkdir(parents=True, exist_ok=True)
+        else:
+            with zf.open(member) as source:
+                _write_member(source, path, member.external_attr >> 16)
+
+        completed += member.file_size
+        if callback is not None and length:
+            callback(completed / length)
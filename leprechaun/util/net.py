@@ -0,0 +1,8 @@
+import socket
+
+
+def free_port(host="127.0.0.1") -> int:
+    """Return a TCP port that is currently free on `host`, for a child process to listen on."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
@@ -0,0 +1,184 @@
+"""Reading the output of many child processes from a single thread.
+
+On POSIX, pipes are multiplexed with `selectors`. Windows can not wait on anonymous pipes, so there they are polled with
+`PeekNamedPipe` instead, which only reads pipes that have data available.
+"""
+import codecs
+import os
+import sys
+from threading import Lock, Thread
+from time import monotonic, sleep
+
+if sys.platform == "win32":
+    import msvcrt
+
+    import pywintypes
+    import win32pipe
+else:
+    import selectors
+
+
+class _Stream:
+    """Stdout of one process, decoded incrementally and split into lines."""
+
+    def __init__(self, proc, on_output, on_exit):
+        self.proc = proc
+        self.fd = proc.stdout.fileno()
+        self.on_output = on_output
+        self.on_exit = on_exit
+
+        if sys.platform == "win32":
+            self.handle = msvcrt.get_osfhandle(self.fd)
+
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.tail = ""
+        self.lines = []
+        self.eof = False
+
+    def feed(self, data: bytes):
+        """Decode a chunk of output. An empty chunk means end of file."""
+        final = data == b""
+        text = self.tail + self.decoder.decode(data, final=final)
+
+        *lines, self.tail = text.split("\n")
+        if final:
+            lines.append(self.tail)
+            self.tail = ""
+            self.eof = True
+
+        for line in lines:
+            line = line.strip()
+            if line != "":
+                self.lines.append(line)
+
+    def flush(self):
+        if self.lines:
+            lines, self.lines = self.lines, []
+            self.on_output(lines)
+
+
+class Reactor:
+    """A thread that reads stdout of every registered process.
+
+    Output is delivered in batches of lines, at most once per `batch_interval` seconds per process. When a process
+    closes its stdout and exits, the remaining output is delivered, followed by its return code.
+    All callbacks are called from the reactor thread.
+    """
+
+    def __init__(self, batch_interval=0.1, chunk_size=1 << 16):
+        self.batch_interval = batch_interval
+        self.chunk_size = chunk_size
+
+        self._streams: list[_Stream] = []
+        """Streams owned by the reactor thread."""
+        self._pending: list[_Stream] = []
+        """Streams added from other threads, not yet picked up by the reactor thread."""
+        self._lock = Lock()
+        self._thread = None
+
+        if sys.platform != "win32":
+            self._selector = selectors.DefaultSelector()
+            self._wake_r, self._wake_w = os.pipe()
+            os.set_blocking(self._wake_r, False)
+            self._selector.register(self._wake_r, selectors.EVENT_READ)
+
+    def add(self, proc, on_output, on_exit):
+        """Start reading stdout of a `subprocess.Popen` opened with `stdout=PIPE` in binary mode.
+
+        `on_output` is called with a list of non-empty lines, stripped of surrounding whitespace. `on_exit` is called
+        with the return code once the process has exited.
+        """
+        with self._lock:
+            self._pending.append(_Stream(proc, on_output, on_exit))
+
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name="reactor", daemon=True)
+                self._thread.start()
+
+        if sys.platform != "win32":
+            os.write(self._wake_w, b"\0")
+
+    # Internal =========================================================================================================
+    def _run(self):
+        flushed = monotonic()
+
+        while True:
+            with self._lock:
+                for stream in self._pending:
+                    self._register(stream)
+                self._pending.clear()
+
+            # Without any processes, there is nothing to wait for until one is added
+            timeout = self.batch_interval if self._streams else None
+            self._read([stream for stream in self._streams if not stream.eof], timeout)
+
+            now = monotonic()
+            if now - flushed < self.batch_interval:
+                continue
+            flushed = now
+
+            for stream in self._streams:
+                stream.flush()
+
+            # A process may close its stdout slightly before exiting
+            for stream in [stream for stream in self._streams if stream.eof and stream.proc.poll() is not None]:
+                self._streams.remove(stream)
+                stream.proc.stdout.close()
+                stream.on_exit(stream.proc.returncode)
+
+    def _register(self, stream):
+        self._streams.append(stream)
+
+        if sys.platform != "win32":
+            os.set_blocking(stream.fd, False)
+            self._selector.register(stream.fd, selectors.EVENT_READ, stream)
+
+    def _finish(self, stream):
+        stream.feed(b"")
+
+        if sys.platform != "win32":
+            self._selector.unregister(stream.fd)
+
+    if sys.platform == "win32":
+        def _read(self, streams, timeout):
+            """Read all available output, or sleep for `timeout` seconds if there is none."""
+            timeout = timeout or self.batch_interval
+            received = False
+
+            for stream in streams:
+                try:
+                    _, available, _ = win32pipe.PeekNamedPipe(stream.handle, 0)
+                except pywintypes.error:
+                    # The other end of the pipe is closed
+                    self._finish(stream)
+                    continue
+
+                if available:
+                    stream.feed(os.read(stream.fd, min(available, self.chunk_size)))
+                    received = True
+
+            if not received:
+                sleep(timeout)
+    else:
+        def _read(self, streams, timeout):
+            """Read all available output, waiting up to `timeout` seconds for some to arrive."""
+            for key, _ in self._selector.select(timeout):
+                if key.fd == self._wake_r:
+                    while True:
+                        try:
+                            if not os.read(self._wake_r, 4096):
+                                break
+                        except BlockingIOError:
+                            break
+                    continue
+
+                stream = key.data
+                try:
+                    data = os.read(stream.fd, self.chunk_size)
+                except BlockingIOError:
+                    continue
+
+                if data:
+                    stream.feed(data)
+                else:
+                    self._finish(stream)
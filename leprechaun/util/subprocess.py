@@ -1,11 +1,16 @@
+import os
 import sys
 import subprocess as sp
 from functools import wraps
+from typing import Optional
 
 if sys.platform == "win32":
+    import ctypes
+
     import win32api
     import win32con
     import win32job
+    import win32process
 
     # Create a Job Object - a container for running processes in Windows that ensures that child processes will die
     # Borrowed from https://stackoverflow.com/a/23587108
@@ -26,6 +31,67 @@ if sys.platform == "win32":
 
         return proc
 
+    # Suspending a whole process is only exposed by the native API
+    PROCESS_SUSPEND_RESUME = 0x0800
+    ntdll = ctypes.WinDLL("ntdll")
+
+    def suspend(proc: sp.Popen):
+        """Freeze all threads of a process."""
+        hProcess = win32api.OpenProcess(PROCESS_SUSPEND_RESUME, False, proc.pid)
+        try:
+            ntdll.NtSuspendProcess(int(hProcess))
+        finally:
+            win32api.CloseHandle(hProcess)
+
+    def resume(proc: sp.Popen):
+        """Unfreeze a process frozen with `suspend`."""
+        hProcess = win32api.OpenProcess(PROCESS_SUSPEND_RESUME, False, proc.pid)
+        try:
+            ntdll.NtResumeProcess(int(hProcess))
+        finally:
+            win32api.CloseHandle(hProcess)
+
+    def memory_usage(proc: sp.Popen) -> Optional[int]:
+        """Return the amount of memory a process holds, in bytes, or None if it is not known."""
+        try:
+            hProcess = win32api.OpenProcess(
+                win32con.PROCESS_QUERY_INFORMATION | win32con.PROCESS_VM_READ, False, proc.pid
+            )
+        except win32api.error:
+            return None
+
+        try:
+            return win32process.GetProcessMemoryInfo(hProcess)["PagefileUsage"]
+        finally:
+            win32api.CloseHandle(hProcess)
+
+    def peak_memory_usage(proc: sp.Popen) -> Optional[int]:
+        """Return the largest resident set size a process has had, in bytes, or None if it is not known."""
+        try:
+            hProcess = win32api.OpenProcess(
+                win32con.PROCESS_QUERY_INFORMATION | win32con.PROCESS_VM_READ, False, proc.pid
+            )
+        except win32api.error:
+            return None
+
+        try:
+            return win32process.GetProcessMemoryInfo(hProcess)["PeakWorkingSetSize"]
+        finally:
+            win32api.CloseHandle(hProcess)
+
+    def cpu_time(proc: sp.Popen) -> Optional[float]:
+        """Return user and system CPU time a process has used, in seconds, or None if it is not known."""
+        try:
+            hProcess = win32api.OpenProcess(win32con.PROCESS_QUERY_INFORMATION, False, proc.pid)
+        except win32api.error:
+            return None
+
+        try:
+            times = win32process.GetProcessTimes(hProcess)
+            return (times["UserTime"] + times["KernelTime"]) / 10**7  # In units of 100 ns
+        finally:
+            win32api.CloseHandle(hProcess)
+
 elif sys.platform.startswith("linux"):
     import ctypes
     import signal
@@ -51,3 +117,45 @@ else:
     @wraps(sp.Popen)
     def popen(proc_args, **kwargs):
         return sp.Popen(proc_args, **kwargs)
+
+
+if sys.platform != "win32":
+    import signal
+
+    def suspend(proc: sp.Popen):
+        """Freeze all threads of a process."""
+        proc.send_signal(signal.SIGSTOP)
+
+    def resume(proc: sp.Popen):
+        """Unfreeze a process frozen with `suspend`."""
+        proc.send_signal(signal.SIGCONT)
+
+    def memory_usage(proc: sp.Popen) -> Optional[int]:
+        """Return the amount of memory a process holds, in bytes, or None if it is not known."""
+        try:
+            with open(f"/proc/{proc.pid}/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            return None  # Not Linux, or the process is gone
+
+    def peak_memory_usage(proc: sp.Popen) -> Optional[int]:
+        """Return the largest resident set size a process has had, in bytes, or None if it is not known."""
+        try:
+            with open(f"/proc/{proc.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError):
+            pass  # Not Linux, or the process is gone
+
+        return None
+
+    def cpu_time(proc: sp.Popen) -> Optional[float]:
+        """Return user and system CPU time a process has used, in seconds, or None if it is not known."""
+        try:
+            with open(f"/proc/{proc.pid}/stat") as f:
+                # The command name may contain spaces, so fields are counted from its closing parenthesis
+                fields = f.read().rpartition(")")[2].split()
+            return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        except (OSError, ValueError, IndexError):
+            return None
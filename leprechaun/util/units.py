@@ -0,0 +1,45 @@
+from decimal import Decimal, getcontext, localcontext
+
+from calc import calc, default_identifiers
+
+from .exceptions import InvalidConfigError
+
+
+def parse_duration(data, field) -> float:
+    """Parse a config field with a duration, like "1.5m" or "1h + 30m", into seconds."""
+    # Using decimal here for precision and to track that a suffix was applied
+    getcontext().prec = 3
+    value = _calc(data[field], {
+        ("s",  "postfix"): Decimal,
+        ("ms", "postfix"): lambda val: Decimal(val) / 1000,
+        ("m",  "postfix"): lambda val: Decimal(val) * 60,
+        ("h",  "postfix"): lambda val: Decimal(val) * 60 * 60,
+        ("d",  "postfix"): lambda val: Decimal(val) * 60 * 60 * 24,
+    })
+    if not isinstance(value, Decimal):
+        raise InvalidConfigError(f"invalid type for '{field}' field (use ms, s, m, h, d suffixes to designate time)")
+
+    return float(value)
+
+
+def parse_size(data, field) -> int:
+    """Parse a config field with an amount of memory, like "512MB" or "4GB", into bytes. Units are powers of 1024."""
+    with localcontext() as context:
+        context.prec = 28
+        value = _calc(data[field], {
+            ("B",  "postfix"): Decimal,
+            ("KB", "postfix"): lambda val: Decimal(val) * 1024,
+            ("MB", "postfix"): lambda val: Decimal(val) * 1024 ** 2,
+            ("GB", "postfix"): lambda val: Decimal(val) * 1024 ** 3,
+        })
+    if not isinstance(value, Decimal):
+        raise InvalidConfigError(f"invalid type for '{field}' field (use B, KB, MB, GB suffixes to designate size)")
+
+    return int(value)
+
+
+def _calc(expr, unary_operators):
+    # Plain numbers have no unit, and are rejected by the callers
+    if not isinstance(expr, str):
+        return expr
+    return calc(expr, default_identifiers, unary_operators)
@@ -1,44 +1,123 @@
-from itertools import chain
 from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from itertools import chain, islice
 
-from PySide6.QtCore import QSize, Qt, Signal
-from PySide6.QtGui import QIcon
+from PySide6.QtCore import QSize, Qt, QTimer, Signal
+from PySide6.QtGui import QFont, QIcon
 from PySide6.QtWidgets import (
-    QFrame, QGridLayout, QLabel, QStyle, QStyledItemDelegate, QTextEdit, QTreeWidget, QTreeWidgetItem, QWidget
+    QComboBox, QFrame, QGridLayout, QLabel, QPlainTextEdit, QStyle, QStyledItemDelegate, QTreeWidget, QTreeWidgetItem,
+    QVBoxLayout, QWidget
 )
 
 import leprechaun as le
+from leprechaun.conditions import Context
 from .base import defaultfont, font, rem, rempt
 
 
-class Log(QTextEdit):
+class Log(QWidget):
+    """Log window of a single miner.
+
+    Incoming lines are collected and appended once per frame, and the view keeps at most `max_lines` lines.
+    """
+    filters = {
+        "All lines": None,
+        "Hashrate": {"hashrate"},
+        "Shares": {"accepted", "rejected"},
+        "Errors": {"error"},
+    }
+    """Filter names and kinds of samples that a line must contain to be shown. None shows every line."""
+
+    frame_interval = 16
+    max_lines = 1000
+    max_scan_lines = 20000
+    """How many of the newest lines are searched for matches when the filter changes. The search runs on the GUI
+    thread, so a filter that rarely matches must not read through the whole log.
+    """
+
     _registry = {}
 
     def __init__(self, miner):
         super().__init__()
+        self.miner = miner
+        self.kinds = None
+        self.pending = []
+
         self.setWindowTitle(f"Log file for miner '{miner.name}'")
         self.setAttribute(Qt.WA_DeleteOnClose, True)
 
-        self.setFontFamily("Consolas")
-        self.setLineWrapMode(QTextEdit.NoWrap)
-        self.setReadOnly(True)
-        self.setText("\n".join(miner.log))
-        miner.logUpdated.connect(self.append)
+        self.wfilter = QComboBox()
+        self.wfilter.addItems(self.filters.keys())
+        self.wfilter.currentTextChanged.connect(self.setFilter)
+
+        self.wtext = QPlainTextEdit()
+        self.wtext.setFont(QFont("Consolas"))
+        self.wtext.setLineWrapMode(QPlainTextEdit.NoWrap)
+        self.wtext.setReadOnly(True)
+        self.wtext.setMaximumBlockCount(self.max_lines)
+
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(self.frame_interval)
+        self.flush_timer.timeout.connect(self.flush)
+
+        ly = QVBoxLayout()
+        ly.setContentsMargins(0, 0, 0, 0)
+        ly.setSpacing(0)
+        ly.addWidget(self.wfilter)
+        ly.addWidget(self.wtext)
+        self.setLayout(ly)
+
+        self.setFilter(self.wfilter.currentText())
+        miner.logUpdated.connect(self.enqueue)
 
         # Add self to a registry to not get accidentally deleted
         self._registry[id(self)] = self
 
-    def append(self, text: str):
-        scrollbar = self.verticalScrollBar()
+    def accepts(self, line: str):
+        if self.kinds is None:
+            return True
+        return any(kind in self.kinds for kind, _ in self.miner.parser.parse(line))
+
+    def setFilter(self, name: str):
+        """Show only lines that match a filter from `filters`."""
+        self.kinds = self.filters[name]
+        self.pending.clear()
+        # Newest matching lines, read back from the end of the log
+        recent = islice(reversed(self.miner.log), self.max_scan_lines)
+        lines = list(islice((line for line in recent if self.accepts(line)), self.max_lines))
+        lines.reverse()
+
+        self.wtext.setPlainText("\n".join(lines))
+        self.scrollToBottom()
+
+    def enqueue(self, text: str):
+        """Schedule new log lines to be shown on the next frame."""
+        self.pending.extend(line for line in text.split("\n") if self.accepts(line))
+
+        if self.pending and not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def flush(self):
+        if not self.pending:
+            return
+
+        scrollbar = self.wtext.verticalScrollBar()
         at_bottom = scrollbar.value() == scrollbar.maximum()
 
-        super().append(text)
+        self.wtext.appendPlainText("\n".join(self.pending))
+        self.pending.clear()
 
         if at_bottom:
-            scrollbar.setValue(scrollbar.maximum())
+            self.scrollToBottom()
+
+    def scrollToBottom(self):
+        scrollbar = self.wtext.verticalScrollBar()
+        scrollbar.setValue(scrollbar.maximum())
 
     def closeEvent(self, event):
         super().closeEvent(event)
+        self.flush_timer.stop()
+        self.miner.logUpdated.disconnect(self.enqueue)
         self._registry.pop(id(self))
 
 
@@ -98,22 +177,48 @@ class MinerTree(QTreeWidget):
             MinerTree.icon_paused = QIcon(str(le.sdata_dir / "icons" / "status-paused.svg"))
 
     def update(self):
+        context = Context()
+
         for name, miner in chain(self.app.cpuminers.items(), self.app.gpuminers.items()):
             item = self.findItems(name, Qt.MatchExactly | Qt.MatchRecursive)[0]
 
-            if miner.running:
+            if miner.suspended:
+                item.setIcon(0, self.icon_paused)
+            elif miner.running:
                 item.setIcon(0, self.icon_running)
             elif miner.broken:
                 item.setIcon(0, self.icon_broken)
             elif not miner.enabled:
                 item.setIcon(0, self.icon_disabled)
+            elif not miner.ready:
+                item.setIcon(0, self.icon_paused)
             elif self.app.paused:
                 item.setIcon(0, self.icon_paused)
-            elif not miner.allowed:
+            elif not miner.allowed(context):
                 item.setIcon(0, self.icon_not_allowed)
             else:
                 item.setIcon(0, self.icon_ready)
 
+            run_stats = miner.supervisor.stats()
+            tooltip = (
+                f"Started {run_stats['starts']} times, restarted after a crash {run_stats['restarts']} times\n"
+                f"Uptime: {timedelta(seconds=round(run_stats['uptime']))}\n"
+                f"Crashed {run_stats['crashes']} times"
+            )
+            if run_stats["last_crash"] is not None:
+                tooltip += f", last at {run_stats['last_crash']:%Y-%m-%d %H:%M:%S}"
+                if run_stats["consecutive_crashes"] > 1:
+                    tooltip += f" ({run_stats['consecutive_crashes']} in a row)"
+            if miner.broken:
+                tooltip += f"\nRetrying at {run_stats['retry_at']:%H:%M:%S}"
+
+            stats = miner.api_stats if miner.running else None
+            if stats is not None and stats.threads:
+                unit = "Thread" if miner in self.app.cpuminers.values() else "Device"
+                for i, hashrate in enumerate(stats.threads):
+                    tooltip += f"\n{unit} {i}: " + (f"{hashrate:.1f} H/s" if hashrate is not None else "n/a")
+            item.setToolTip(0, tooltip)
+
             # For some reason, with custom item delegate, viewport does not update when
             # a mouse is not moving over it
             self.viewport().update()
@@ -172,6 +277,12 @@ class Dashboard(QWidget):
         self.executor_earnings = ThreadPoolExecutor(max_workers=1)
         self.future_earnings = None
 
+        # The application only updates when miners may switch, but earnings should refresh while the dashboard is open
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(5000)
+        self.refresh_timer.timeout.connect(self.update)
+        self.refresh_timer.start()
+
         # Layout -------------------------------------------------------------------------------------------------------
         self.setContentsMargins(0, 0, 0, 0)
         ly = QGridLayout()
@@ -220,6 +331,7 @@ class Dashboard(QWidget):
 
     def closeEvent(self, event):
         super().closeEvent(event)
+        self.refresh_timer.stop()
         self.app.dashboard = None
         self.deleteLater()
 